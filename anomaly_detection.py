@@ -1,81 +1,294 @@
 import os
 import json
-import pandas as pd
-from sklearn import svm
+import argparse
+import functools
+from datetime import datetime, timezone
+import joblib
+import numpy as np
+from sklearn.ensemble import IsolationForest
+from sklearn.kernel_approximation import Nystroem
+from sklearn.linear_model import SGDOneClassSVM
+from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import StandardScaler
-
-def ip2int(ip):
-    return sum([int(octet) << (24 - i * 8) for i, octet in enumerate(ip.split('.'))])
+import flow_log_parser
+from rule_engine import parse_address
 
 # Set the directory path and anomaly threshold
 directory_path = r'C:\Security\Blogs\Security_List\Logs\ml_parsed_data'
-anomaly_threshold = -1.0  # adjust this value to change the anomaly detection sensitivity
-
-# Initialize the feature extractor and anomaly detector
-feature_extractor = pd.DataFrame(columns=['source_address', 'destination_address', 'port_number', 'protocol'])
-original_data = []  # store the original data records
-anomaly_detector = svm.OneClassSVM(kernel='rbf', gamma=0.1, nu=0.1)
-
-# Iterate through all JSON files in the directory
-for filename in os.listdir(directory_path):
-    if filename.endswith('.json'):
-        # Load the JSON file
-        with open(os.path.join(directory_path, filename), 'r') as f:
-            data = json.load(f)
-        
-        # Store the original data records
-        original_data.extend(data)
-        
-        # Extract features from the JSON data
-        features = pd.DataFrame({
-            'source_address': [ip2int(x['sourceAddress']) for x in data],
-            'destination_address': [ip2int(x['destinationAddress']) for x in data],
-            'port_number': [x['destinationPort'] for x in data],
-            'protocol': [x['protocol'] for x in data]
-        })
-        
-        # Append the features to the feature extractor
-        feature_extractor = pd.concat([feature_extractor, features], ignore_index=True)
-
-# Scale the features using StandardScaler
-scaler = StandardScaler()
-feature_extractor_scaled = scaler.fit_transform(feature_extractor)
-
-# Train the anomaly detector
-anomaly_detector.fit(feature_extractor_scaled)
-
-# Predict anomalies
-anomaly_scores = anomaly_detector.decision_function(feature_extractor_scaled)
-
-# Identify anomalies
-anomaly_indices = [i for i, score in enumerate(anomaly_scores) if score < anomaly_threshold]
-
-# Create a list to store the anomaly records with reasons
-anomaly_records = []
-
-# Iterate through the anomaly indices
-for index in anomaly_indices:
-    # Get the original data record
-    record = original_data[index]
-    
-    # Get the feature vector for the anomaly record
-    feature_vector = feature_extractor_scaled[index]
-    
-    # Calculate the anomaly scores for each feature
-    feature_scores = {}
-    for i, feature_name in enumerate(feature_extractor.columns):
-        feature_score = anomaly_detector.decision_function([feature_vector])[0]
-        feature_scores[feature_name] = feature_score
-    
-    # Create an anomaly record with reasons
-    anomaly_record = {
-        'record': record,
-        'reasons': feature_scores
+output_file_name = 'anomaly_response.json'
+# The fitted scaler and model, and the files already scored, are kept next to the data
+model_file_name = 'anomaly_model.joblib'
+state_file_name = 'anomaly_state.json'
+anomaly_threshold = 0.0  # Flows scoring below this are anomalies; both detectors put the boundary at 0
+contamination = 0.001  # Expected share of anomalous flows, used to place the boundary of either detector
+
+FEATURE_NAMES = ['source_address', 'destination_address', 'port_number', 'protocol']
+# Rows assembled, scaled and scored per batch
+BATCH_SIZE = 500000
+# IsolationForest trains on a random sample; its trees only look at max_samples rows each anyway
+TRAIN_SAMPLE_SIZE = 1000000
+# Passes over the data when training the SGD one-class model with partial_fit
+SGD_EPOCHS = 3
+# The SGD model works on a Nystroem approximation of the original RBF kernel (gamma=0.1)
+KERNEL_GAMMA = 0.1
+NYSTROEM_COMPONENTS = 100
+DETECTORS = ('isolation-forest', 'sgd')
+# In incremental mode the persisted model is retrained after this many days...
+RETRAIN_DAYS = 7
+# ...or when new flows drift from the training data: a scaled feature mean moves by more than
+# DRIFT_THRESHOLD standard deviations, or the anomaly rate exceeds DRIFT_RATE_FACTOR times the rate
+# seen when the model was trained
+DRIFT_THRESHOLD = 0.5
+DRIFT_RATE_FACTOR = 3.0
+
+# Addresses as numbers; IPv6 addresses are kept (as floats) instead of breaking the split on '.'
+@functools.lru_cache(maxsize=65536)
+def ip2int(ip):
+    parsed = parse_address(ip) if isinstance(ip, str) else None
+    return float(parsed[1]) if parsed is not None else -1.0
+
+def as_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return -1.0  # e.g. 'N/A' ports of ICMP flows
+
+def list_input_files(directory_path):
+    return [
+        os.path.join(directory_path, filename) for filename in sorted(os.listdir(directory_path))
+        if filename.startswith('parsed_data_') and flow_log_parser.is_parsed_output(filename)  # Parsed flow files, not the manifest, per-run tables or this script's own files
+    ]
+
+# Yield (features, file index, record index) arrays of up to batch_size flows
+def iter_feature_batches(file_paths, batch_size=BATCH_SIZE):
+    rows, file_indexes, record_indexes = [], [], []
+    for file_index, file_path in enumerate(file_paths):
+        with open(file_path, 'rb') as f:
+            for record_index, x in enumerate(flow_log_parser.iter_parsed_records(f, file_path)):
+                rows.append((ip2int(x['sourceAddress']), ip2int(x['destinationAddress']), as_number(x['destinationPort']), as_number(x['protocol'])))
+                file_indexes.append(file_index)
+                record_indexes.append(record_index)
+                if len(rows) >= batch_size:
+                    yield np.array(rows, dtype=np.float64), np.array(file_indexes, dtype=np.int32), np.array(record_indexes, dtype=np.int64)
+                    rows, file_indexes, record_indexes = [], [], []
+    if rows:
+        yield np.array(rows, dtype=np.float64), np.array(file_indexes, dtype=np.int32), np.array(record_indexes, dtype=np.int64)
+
+# Assemble the feature matrix from batches with a single concatenate at the end. Only the
+# position of each flow is kept; anomalous records are read back from their files afterwards.
+def load_features(file_paths, batch_size=BATCH_SIZE):
+    batches = list(iter_feature_batches(file_paths, batch_size))
+    if not batches:
+        return np.empty((0, len(FEATURE_NAMES))), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64)
+    features, file_indexes, record_indexes = (np.concatenate(parts) for parts in zip(*batches))
+    return features, file_indexes, record_indexes
+
+def fit_scaler(features, batch_size=BATCH_SIZE):
+    scaler = StandardScaler()
+    for start in range(0, len(features), batch_size):
+        scaler.partial_fit(features[start:start + batch_size])
+    return scaler
+
+def train_detector(features, scaler, detector='isolation-forest', batch_size=BATCH_SIZE, random_state=0):
+    rng = np.random.default_rng(random_state)
+    sample = features[rng.choice(len(features), size=min(len(features), TRAIN_SAMPLE_SIZE), replace=False)]
+    if detector == 'isolation-forest':
+        model = IsolationForest(n_estimators=200, contamination=contamination, random_state=random_state, n_jobs=-1)
+        model.fit(scaler.transform(sample))
+        return model
+
+    # Mini-batch training of a linear one-class SVM over shuffled batches. On the centred features
+    # alone a linear boundary is degenerate (the weights collapse to zero), so the flows are mapped
+    # through the kernel approximation first, with landmarks drawn from the sample.
+    feature_map = Nystroem(gamma=KERNEL_GAMMA, n_components=min(NYSTROEM_COMPONENTS, len(sample)), random_state=random_state)
+    feature_map.fit(scaler.transform(sample))
+    model = SGDOneClassSVM(nu=contamination, random_state=random_state)
+    for _ in range(SGD_EPOCHS):
+        order = rng.permutation(len(features))
+        for start in range(0, len(features), batch_size):
+            model.partial_fit(feature_map.transform(scaler.transform(features[order[start:start + batch_size]])))
+    return make_pipeline(feature_map, model)
+
+# One vectorized scoring pass, batch by batch
+def score_features(model, scaler, features, batch_size=BATCH_SIZE):
+    scores = np.empty(len(features))
+    for start in range(0, len(features), batch_size):
+        scores[start:start + batch_size] = model.decision_function(scaler.transform(features[start:start + batch_size]))
+    return scores
+
+def utc_now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+# Persist the fitted scaler and model with the anomaly rate on the training data, which later
+# runs compare against to detect drift
+def save_model(detector, scaler, model, scores):
+    bundle = {
+        'detector': detector,
+        'scaler': scaler,
+        'model': model,
+        'trained_at': utc_now(),
+        'trained_flows': len(scores),
+        'anomaly_rate': float(np.mean(scores < anomaly_threshold))
     }
-    
-    # Append the anomaly record to the list
-    anomaly_records.append(anomaly_record)
+    joblib.dump(bundle, os.path.join(directory_path, model_file_name))
+    return bundle
+
+# Fit the scaler and detector on every file
+def retrain(file_paths, detector, batch_size):
+    features, _, _ = load_features(file_paths, batch_size)
+    scaler = fit_scaler(features, batch_size)
+    model = train_detector(features, scaler, detector, batch_size)
+    print(f"Trained {detector} model on {len(features)} flows from {len(file_paths)} files")
+    return save_model(detector, scaler, model, score_features(model, scaler, features, batch_size))
+
+def load_model():
+    try:
+        return joblib.load(os.path.join(directory_path, model_file_name))
+    except FileNotFoundError:
+        return None
+
+def model_age_days(bundle):
+    trained_at = datetime.strptime(bundle['trained_at'], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - trained_at).total_seconds() / 86400
+
+# Scored files: state['scored'][file name] = {"size", "mtime", "flows", "scored_at"}. A file is
+# scored again only if its size or modification time changes.
+def load_state():
+    try:
+        with open(os.path.join(directory_path, state_file_name), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'scored': {}}
+
+def save_state(state):
+    with open(os.path.join(directory_path, state_file_name), 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+
+def file_signature(file_path):
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+def unscored_files(file_paths, state):
+    unscored = []
+    for file_path in file_paths:
+        entry = state['scored'].get(os.path.basename(file_path))
+        signature = file_signature(file_path)
+        if entry is None or entry['size'] != signature['size'] or entry['mtime'] != signature['mtime']:
+            unscored.append(file_path)
+    return unscored
+
+def mark_scored(state, file_paths, file_indexes):
+    flows = np.bincount(file_indexes, minlength=len(file_paths))
+    for file_path, count in zip(file_paths, flows.tolist()):
+        state['scored'][os.path.basename(file_path)] = dict(file_signature(file_path), flows=count, scored_at=utc_now())
+
+# Describe how new flows drift from the training data, or return None when they do not
+def detect_drift(bundle, features, scores):
+    mean_shift = np.abs(bundle['scaler'].transform(features).mean(axis=0))
+    if mean_shift.max() > DRIFT_THRESHOLD:
+        return f"{FEATURE_NAMES[int(mean_shift.argmax())]} mean moved {mean_shift.max():.2f} standard deviations"
+    anomaly_rate = float(np.mean(scores < anomaly_threshold))
+    if anomaly_rate > DRIFT_RATE_FACTOR * max(bundle['anomaly_rate'], contamination):
+        return f"anomaly rate {anomaly_rate:.4f} against {bundle['anomaly_rate']:.4f} at training"
+    return None
+
+# Build the anomaly records: the original record, its score and, as the reasons, how many standard
+# deviations each feature is from the mean. Each file with anomalies is read once more.
+def build_anomaly_records(file_paths, features, file_indexes, record_indexes, scores, scaler):
+    anomaly_indices = np.flatnonzero(scores < anomaly_threshold)
+    anomaly_indices = anomaly_indices[np.argsort(scores[anomaly_indices], kind='stable')]
+    if len(anomaly_indices) == 0:
+        return []
+    deviations = scaler.transform(features[anomaly_indices])
+
+    wanted = {}
+    for index in anomaly_indices.tolist():
+        wanted.setdefault(int(file_indexes[index]), set()).add(int(record_indexes[index]))
+    records = {}
+    for file_index, record_positions in wanted.items():
+        with open(file_paths[file_index], 'rb') as f:
+            for record_index, record in enumerate(flow_log_parser.iter_parsed_records(f, file_paths[file_index])):
+                if record_index in record_positions:
+                    records[(file_index, record_index)] = record
+
+    anomaly_records = []
+    for index, deviation in zip(anomaly_indices.tolist(), deviations.tolist()):
+        anomaly_records.append({
+            'record': records[(int(file_indexes[index]), int(record_indexes[index]))],
+            'score': float(scores[index]),
+            'reasons': dict(zip(FEATURE_NAMES, deviation))
+        })
+    return anomaly_records
+
+def write_anomalies(file_paths, features, file_indexes, record_indexes, scores, scaler):
+    anomaly_records = build_anomaly_records(file_paths, features, file_indexes, record_indexes, scores, scaler)
+    with open(os.path.join(directory_path, output_file_name), 'w') as f:
+        json.dump(anomaly_records, f, indent=4)
+    print(f"Found {len(anomaly_records)} anomalies")
+
+# Train on every file and score every flow; the model is saved so incremental runs can reuse it
+def main(detector, batch_size):
+    file_paths = list_input_files(directory_path)
+    features, file_indexes, record_indexes = load_features(file_paths, batch_size)
+    if len(features) == 0:
+        print(f"No flows found in {directory_path}")
+        return
+    print(f"Loaded {len(features)} flows from {len(file_paths)} files")
+
+    # Scale the features, train the anomaly detector and score every flow
+    scaler = fit_scaler(features, batch_size)
+    model = train_detector(features, scaler, detector, batch_size)
+    scores = score_features(model, scaler, features, batch_size)
+    save_model(detector, scaler, model, scores)
+
+    # Write the anomaly records to a JSON file
+    write_anomalies(file_paths, features, file_indexes, record_indexes, scores, scaler)
+    state = {'scored': {}}
+    mark_scored(state, file_paths, file_indexes)
+    save_state(state)
+
+# Score only the files not scored yet against the persisted model, retraining it first when it is
+# missing, older than retrain_days or built with another detector, and again when the new flows drift
+def main_incremental(detector, batch_size, retrain_days, force_retrain=False):
+    file_paths = list_input_files(directory_path)
+    if not file_paths:
+        print(f"No flows found in {directory_path}")
+        return
+    state = load_state()
+    new_files = unscored_files(file_paths, state)
+    bundle = load_model()
+    retrained = False
+    if force_retrain or bundle is None or bundle['detector'] != detector or model_age_days(bundle) >= retrain_days:
+        bundle = retrain(file_paths, detector, batch_size)
+        retrained = True
+
+    if not new_files:
+        print("No new files to score")
+        return
+    features, file_indexes, record_indexes = load_features(new_files, batch_size)
+    print(f"Loaded {len(features)} new flows from {len(new_files)} files")
+    scores = score_features(bundle['model'], bundle['scaler'], features, batch_size)
+
+    drift = None if retrained or len(features) == 0 else detect_drift(bundle, features, scores)
+    if drift is not None:
+        print(f"Drift detected ({drift}), retraining")
+        bundle = retrain(file_paths, detector, batch_size)
+        scores = score_features(bundle['model'], bundle['scaler'], features, batch_size)
+
+    write_anomalies(new_files, features, file_indexes, record_indexes, scores, bundle['scaler'])
+    mark_scored(state, new_files, file_indexes)
+    save_state(state)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect anomalous flows in parsed flow log files")
+    parser.add_argument("--detector", choices=DETECTORS, default='isolation-forest', help="Anomaly detection model")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Flows assembled and scored per batch")
+    parser.add_argument("--incremental", action="store_true", help="Score only new files against the saved model")
+    parser.add_argument("--retrain-days", type=float, default=RETRAIN_DAYS, help="Age in days after which the saved model is retrained")
+    parser.add_argument("--retrain", action="store_true", help="Retrain the saved model before an incremental run")
+    args = parser.parse_args()
 
-# Write the anomaly records to a JSON file
-with open(os.path.join(directory_path, 'anomaly_response.json'), 'w') as f:
-    json.dump(anomaly_records, f, indent=4)
\ No newline at end of file
+    if args.incremental:
+        main_incremental(args.detector, args.batch_size, args.retrain_days, args.retrain)
+    else:
+        main(args.detector, args.batch_size)
@@ -0,0 +1,157 @@
+import argparse
+import ipaddress
+import json
+import random
+import time
+from datetime import datetime, timedelta
+import flow_log_parser
+
+# Compares the flow log line decoder in flow_log_parser.py with the original per-line
+# json.loads + strptime loop on synthetic lines, and reports lines/sec for each.
+# Usage: python benchmark_parse.py --lines 200000 > bench_output.txt
+
+ACTIONS = ['ACCEPT', 'REJECT']
+PROTOCOLS = [(6, 'TCP'), (17, 'UDP'), (1, 'ICMP')]
+
+
+# Synthetic flow log lines in the Object Storage export format, spread over the last 60 days
+def synthetic_lines(count, seed=0):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    lines = []
+    for _ in range(count):
+        protocol, protocol_name = rng.choice(PROTOCOLS)
+        ingested = now - timedelta(seconds=rng.randint(0, 60 * 24 * 3600))
+        lines.append(json.dumps({
+            "datetime": int(ingested.timestamp() * 1000),
+            "data": {
+                "action": rng.choice(ACTIONS),
+                "bytesOut": rng.randint(40, 100000),
+                "destinationAddress": f"10.0.{rng.randint(0, 3)}.{rng.randint(1, 254)}",
+                "destinationPort": rng.choice([22, 80, 443, 1521, rng.randint(1024, 65535)]),
+                "endTime": int(ingested.timestamp()),
+                "flowid": f"{rng.getrandbits(32):08x}",
+                "packets": rng.randint(1, 100),
+                "protocol": protocol,
+                "protocolName": protocol_name,
+                "sourceAddress": rng.choice([f"10.0.{rng.randint(0, 3)}.{rng.randint(1, 254)}",
+                                             f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"]),
+                "sourcePort": rng.randint(1024, 65535),
+                "startTime": int(ingested.timestamp()) - 60,
+                "status": "OK",
+                "version": "2"
+            },
+            "id": f"{rng.getrandbits(64):016x}",
+            "oracle": {
+                "compartmentid": "ocid1.compartment.oc1..example",
+                "ingestedtime": ingested.strftime("%Y-%m-%dT%H:%M:%S.") + f"{ingested.microsecond // 1000:03d}Z",
+                "loggroupid": "ocid1.loggroup.oc1.iad.example",
+                "logid": "ocid1.log.oc1.iad.example",
+                "tenantid": "ocid1.tenancy.oc1..example",
+                "vniccompartmentocid": "ocid1.compartment.oc1..example",
+                "vnicocid": "ocid1.vnic.oc1.iad.example",
+                "vnicsubnetocid": "ocid1.subnet.oc1.iad.example"
+            },
+            "source": "-",
+            "specversion": "1.0",
+            "time": ingested.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "type": "com.oraclecloud.vcn.flowlogs.DataEvent"
+        }).encode('utf-8'))
+    return lines
+
+
+LEGACY_PRIVATE_IP_RANGES = [ipaddress.ip_network(cidr) for cidr in flow_log_parser.PRIVATE_IP_RANGES]
+
+
+def legacy_is_internal_ip(ip):
+    try:
+        ip_obj = ipaddress.ip_address(ip)
+        for net in LEGACY_PRIVATE_IP_RANGES:
+            if ip_obj in net:
+                return "internal"
+        return "external"
+    except ValueError:
+        return "invalid"
+
+
+# The decoder as it was before flow_log_parser grew the prefilter, for comparison
+def legacy_decode_log_lines(lines, time_threshold):
+    result_list = []
+    for line in lines:
+        try:
+            log_entry = json.loads(line)
+            ingested_time = log_entry['oracle']['ingestedtime']
+            try:
+                ingested_datetime = datetime.strptime(ingested_time, "%Y-%m-%dT%H:%M:%S.%fZ")
+            except ValueError:
+                ingested_datetime = datetime.strptime(ingested_time, "%Y-%m-%dT%H:%M:%SZ")
+
+            if ingested_datetime < time_threshold:
+                continue
+
+            if log_entry['data'].get('action') == 'ACCEPT':
+                source_address = log_entry['data'].get('sourceAddress', 'N/A')
+                destination_address = log_entry['data'].get('destinationAddress', 'N/A')
+                result_list.append({
+                    "destinationAddress": destination_address,
+                    "destinationPort": log_entry['data'].get('destinationPort', 'N/A'),
+                    "protocol": log_entry['data'].get('protocol', 'N/A'),
+                    "protocolName": log_entry['data'].get('protocolName', 'N/A'),
+                    "sourceAddress": source_address,
+                    "internal_or_external_source": legacy_is_internal_ip(source_address),
+                    "internal_or_external_destination": legacy_is_internal_ip(destination_address),
+                    "traffic_direction": "N/A",
+                    "traffic_type": "external traffic",
+                    "security_list_ocids": [],
+                    "vnicsubnetocid": log_entry['oracle'].get('vnicsubnetocid', 'N/A'),
+                    "vnicocid": log_entry['oracle'].get('vnicocid', 'N/A'),
+                    "ingestedtime": ingested_time
+                })
+        except json.JSONDecodeError:
+            print(f"Skipping invalid JSON: {line}")
+    return result_list
+
+
+def run(name, decode, lines, time_threshold, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        records = decode(lines, time_threshold)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{name:<24} {len(lines) / best:>12,.0f} lines/sec  ({len(records)} records, {best:.3f}s)")
+    return records
+
+
+def main(line_count, days, repeat):
+    lines = synthetic_lines(line_count)
+    time_threshold = datetime.utcnow() - timedelta(days=days)
+    print(f"{line_count} lines, {days} day window, best of {repeat}")
+
+    expected = run("legacy json+strptime", legacy_decode_log_lines, lines, time_threshold, repeat)
+
+    loads = flow_log_parser._loads
+    try:
+        flow_log_parser._loads = json.loads
+        records = run("prefilter + json", flow_log_parser.decode_log_lines, lines, time_threshold, repeat)
+        if records != expected:
+            print("  WARNING: records differ from the legacy decoder")
+        if flow_log_parser.orjson is not None:
+            flow_log_parser._loads = flow_log_parser.orjson.loads
+            records = run("prefilter + orjson", flow_log_parser.decode_log_lines, lines, time_threshold, repeat)
+            if records != expected:
+                print("  WARNING: records differ from the legacy decoder")
+        else:
+            print("prefilter + orjson       skipped (orjson is not installed)")
+    finally:
+        flow_log_parser._loads = loads
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the flow log line decoder")
+    parser.add_argument("--lines", type=int, default=200000, help="Number of synthetic lines")
+    parser.add_argument("--days", type=int, default=30, help="Time window, as used by get_Flow_Logs_from_OS.py")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per decoder; the best one is reported")
+    args = parser.parse_args()
+
+    main(args.lines, args.days, args.repeat)
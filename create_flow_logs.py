@@ -1,5 +1,6 @@
 import oci, sys
 import random,string
+import flow_log_index
 
 # Initialize OCI config and clients
 config = oci.config.from_file() 
@@ -25,26 +26,14 @@ def list_compartments(identity_client, tenancy_id):
 # Function to fetch log groups and logs once and store them in a dict for lookup
 def fetch_log_groups_and_logs(tenancy_id):
     log_dict = {}
-    
-    log_groups = oci.pagination.list_call_get_all_results(
-        logging_client.list_log_groups,
-        tenancy_id,
-        is_compartment_id_in_subtree=True
-    ).data
-    
-    for log_group in log_groups:
-        logs = logging_client.list_logs(
-            log_group_id=log_group.id,
-            log_type="SERVICE"
-        ).data
-        for log in logs:
-            log_dict[log.configuration.source.resource] = {
-                "log_group_id": log_group.id,
-                "log_group_display_name": log_group.display_name,
-                "log_id": log.id,
-                "log_display_name": log.display_name
-            }
-    
+    log_index = flow_log_index.build_flow_log_index(logging_client, tenancy_id, services=None)
+    for resource_id, (log_group_id, log_group_name, log_id, log_name) in log_index.items():
+        log_dict[resource_id] = {
+            "log_group_id": log_group_id,
+            "log_group_display_name": log_group_name,
+            "log_id": log_id,
+            "log_display_name": log_name
+        }
     return log_dict
 
 # Function to create a new log group if not exists
@@ -0,0 +1,104 @@
+from array import array
+
+# Interned ids are packed into one integer key, KEY_BITS bits per key field
+KEY_BITS = 32
+_KEY_MASK = (1 << KEY_BITS) - 1
+
+
+class FlowCounter:
+    # Bounded-memory counter for flow records. Every key field and sample value is interned once,
+    # so a key is a single integer and each distinct key costs one slot: a count, the first and
+    # last seen timestamps (kept as values, not interned, since nearly every record has its own)
+    # and the sample (a tuple of interned ids) taken from the most recently seen record. Memory
+    # grows with the distinct keys and values, not the records. Partial counters built in
+    # parallel are combined with merge.
+    def __init__(self, key_fields):
+        self.key_fields = list(key_fields)
+        self.strings = []
+        self.ids = {}
+        self.slots = {}
+        self.counts = array('q')
+        self.first_seen = []
+        self.last_seen = []
+        self.samples = []
+
+    def intern(self, value):
+        if isinstance(value, list):
+            value = tuple(value)
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = len(self.strings)
+            self.ids[value] = value_id
+            self.strings.append(value)
+        return value_id
+
+    def _slot(self, key_values):
+        key = 0
+        for value in key_values:
+            key = (key << KEY_BITS) | self.intern(value)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = len(self.counts)
+            self.slots[key] = slot
+            self.counts.append(0)
+            self.first_seen.append(None)
+            self.last_seen.append(None)
+            self.samples.append(None)
+        return slot
+
+    # Count one occurrence. seen is a sortable timestamp string (e.g. ingestedtime) or None; the
+    # sample is kept when this is the latest occurrence so far
+    def add(self, key_values, seen=None, sample=None, count=1):
+        slot = self._slot(key_values)
+        self.counts[slot] += count
+        sample_ids = None if sample is None else tuple(self.intern(value) for value in sample)
+        self._observe(slot, seen, sample_ids)
+
+    def _observe(self, slot, seen, sample_ids):
+        if seen is None:
+            if self.last_seen[slot] is None and sample_ids is not None:
+                self.samples[slot] = sample_ids
+            return
+        first = self.first_seen[slot]
+        if first is None or seen < first:
+            self.first_seen[slot] = seen
+        last = self.last_seen[slot]
+        if last is None or seen >= last:
+            self.last_seen[slot] = seen
+            if sample_ids is not None:
+                self.samples[slot] = sample_ids
+
+    # Fold another counter (e.g. one file's partial result) into this one
+    def merge(self, other):
+        for key, other_slot in other.slots.items():
+            key_values = other._key_values(key)
+            slot = self._slot(key_values)
+            self.counts[slot] += other.counts[other_slot]
+            other_sample = other.samples[other_slot]
+            sample_ids = None if other_sample is None else tuple(self.intern(other.strings[value_id]) for value_id in other_sample)
+            if other.first_seen[other_slot] is not None:
+                self._observe(slot, other.first_seen[other_slot], None)
+            self._observe(slot, other.last_seen[other_slot], sample_ids)
+        return self
+
+    def _key_values(self, key):
+        value_ids = []
+        for _ in self.key_fields:
+            value_ids.append(key & _KEY_MASK)
+            key >>= KEY_BITS
+        return tuple(self.strings[value_id] for value_id in reversed(value_ids))
+
+    def __len__(self):
+        return len(self.counts)
+
+    # Yield (key values, count, first seen, last seen, sample) for every distinct key
+    def items(self):
+        for key, slot in self.slots.items():
+            sample = self.samples[slot]
+            yield (
+                self._key_values(key),
+                self.counts[slot],
+                self.first_seen[slot],
+                self.last_seen[slot],
+                None if sample is None else tuple(self.strings[value_id] for value_id in sample)
+            )
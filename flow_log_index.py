@@ -0,0 +1,47 @@
+import oci
+from concurrent.futures import ThreadPoolExecutor
+
+# Log source services that produce VCN flow logs
+FLOW_LOG_SERVICES = ['flowlogstest', 'flowlogs']
+
+# Number of log groups whose logs are listed concurrently
+LIST_LOGS_WORKERS = 8
+
+
+def list_service_logs(logging_client, log_group):
+    try:
+        return oci.pagination.list_call_get_all_results(
+            logging_client.list_logs,
+            log_group_id=log_group.id,
+            log_type="SERVICE"
+        ).data
+    except Exception as e:
+        print(f"Failed to list logs for log group {log_group.id}: {e}")
+        return []
+
+
+# Build a resource OCID -> (log group id, log group name, log id, log name) index for every
+# service log under the compartment subtree. One paginated list_logs call per log group,
+# run in parallel, replaces the per-subnet scans of every log group.
+def build_flow_log_index(logging_client, compartment_id, services=FLOW_LOG_SERVICES, max_workers=LIST_LOGS_WORKERS):
+    try:
+        log_groups = oci.pagination.list_call_get_all_results(
+            logging_client.list_log_groups,
+            compartment_id,
+            is_compartment_id_in_subtree=True
+        ).data
+    except Exception as e:
+        print(f"Failed to list log groups: {e}")
+        return {}
+
+    flow_log_index = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # executor.map keeps the log group order, so the first log found for a resource wins
+        all_logs = executor.map(lambda log_group: list_service_logs(logging_client, log_group), log_groups)
+        for log_group, logs in zip(log_groups, all_logs):
+            for log in logs:
+                source = log.configuration.source
+                if services is not None and source.service not in services:
+                    continue
+                flow_log_index.setdefault(source.resource, (log_group.id, log_group.display_name, log.id, log.display_name))
+    return flow_log_index
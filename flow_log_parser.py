@@ -0,0 +1,262 @@
+import codecs
+import gzip
+import io
+import json
+import re
+from datetime import datetime
+import ip_classifier
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard library decoder gives the same records
+    orjson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional
+    pa = None
+    pq = None
+
+# CPU-bound part of get_Flow_Logs_from_OS.py. This module has no OCI dependencies so process pool
+# workers can import it cheaply; subnet and security list enrichment stays in the parent process.
+
+# Private IP ranges, compiled once into integer intervals
+PRIVATE_IP_RANGES = ip_classifier.PRIVATE_IP_RANGES
+private_ip_classifier = ip_classifier.IPClassifier(PRIVATE_IP_RANGES)
+
+# Faster JSON backend when installed. orjson.JSONDecodeError subclasses json.JSONDecodeError.
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+_loads = orjson.loads if orjson is not None else json.loads
+
+# Located in the raw line so lines outside the time window are dropped before they are decoded
+INGESTED_TIME_PATTERN = re.compile(rb'"ingestedtime"\s*:\s*"([^"]*)"')
+ACCEPT_MARKER = b'"ACCEPT"'
+
+
+# Turn 'YYYY-MM-DDTHH:MM:SS[.f]Z' into 'YYYY-MM-DDTHH:MM:SS.ffffff', which sorts like the datetime.
+# Returns None for any other shape, in which case the caller falls back to strptime.
+def timestamp_key(timestamp):
+    if len(timestamp) < 20 or timestamp[10] != 'T' or timestamp[-1] != 'Z':
+        return None
+    if len(timestamp) == 20:
+        return timestamp[:19] + '.000000'
+    fraction = timestamp[20:-1]
+    if timestamp[19] != '.' or not 1 <= len(fraction) <= 6 or not fraction.isdigit():
+        return None
+    return timestamp[:20] + fraction.ljust(6, '0')
+
+
+def _ingested_before(ingested_time, threshold_key, time_threshold):
+    key = timestamp_key(ingested_time)
+    if key is not None:
+        return key < threshold_key
+    try:
+        ingested_datetime = datetime.strptime(ingested_time, "%Y-%m-%dT%H:%M:%S.%fZ")
+    except ValueError:
+        # If the above fails, try without microseconds
+        ingested_datetime = datetime.strptime(ingested_time, "%Y-%m-%dT%H:%M:%SZ")
+    return ingested_datetime < time_threshold
+
+
+# Decode raw flow log lines and return the ACCEPT records ingested at or after time_threshold.
+# traffic_direction, traffic_type and security_list_ocids are filled in later by the enrichment step.
+# Lines without an "ACCEPT" token, or whose raw ingestedtime is already outside the window, are
+# dropped without being decoded; the decoded record is still checked, so the result is the same.
+def decode_log_lines(lines, time_threshold):
+    threshold_key = time_threshold.strftime("%Y-%m-%dT%H:%M:%S.%f")
+    result_list = []
+    for line in lines:
+        if isinstance(line, str):
+            line = line.encode('utf-8')
+        if ACCEPT_MARKER not in line:
+            continue
+        match = INGESTED_TIME_PATTERN.search(line)
+        if match is not None:
+            raw_key = timestamp_key(match.group(1).decode('ascii', 'replace'))
+            if raw_key is not None and raw_key < threshold_key:
+                continue
+
+        try:
+            log_entry = _loads(line)
+        except json.JSONDecodeError:
+            print(f"Skipping invalid JSON: {line}")
+            continue
+
+        # Filter based on ingestedtime (last 30 days)
+        oracle = log_entry['oracle']
+        if _ingested_before(oracle['ingestedtime'], threshold_key, time_threshold):
+            continue
+
+        # Filter for 'ACCEPT' action only
+        data = log_entry['data']
+        if data.get('action') != 'ACCEPT':
+            continue
+        source_address = data.get('sourceAddress', 'N/A')
+        destination_address = data.get('destinationAddress', 'N/A')
+        result_list.append({
+            "destinationAddress": destination_address,
+            "destinationPort": data.get('destinationPort', 'N/A'),
+            "protocol": data.get('protocol', 'N/A'),
+            "protocolName": data.get('protocolName', 'N/A'),
+            "sourceAddress": source_address,
+            # Filled in for the whole batch below
+            "internal_or_external_source": None,
+            "internal_or_external_destination": None,
+            "traffic_direction": "N/A",
+            "traffic_type": "external traffic",
+            # Security lists and subnets are written once per run; flows only refer to them by OCID
+            "security_list_ocids": [],
+            "vnicsubnetocid": oracle.get('vnicsubnetocid', 'N/A'),
+            "vnicocid": oracle.get('vnicocid', 'N/A'),
+            "ingestedtime": oracle['ingestedtime']
+        })
+
+    # Determine if the sourceAddress and destinationAddress are internal or external
+    addresses = [record["sourceAddress"] for record in result_list] + [record["destinationAddress"] for record in result_list]
+    labels = private_ip_classifier.classify_batch(addresses)
+    for record, source_label, destination_label in zip(result_list, labels, labels[len(result_list):]):
+        record["internal_or_external_source"] = source_label
+        record["internal_or_external_destination"] = destination_label
+    return result_list
+
+
+# Parsed flow files: gzip-compressed NDJSON (one record per line) or Parquet row groups. Plain
+# .json arrays written by earlier versions can still be read.
+PARSED_OUTPUT_FORMATS = ('ndjson.gz', 'parquet')
+PARSED_ROW_GROUP_SIZE = 10000
+
+# Parquet columns of a parsed record; ports and protocol numbers are null when the log had none
+if pa is not None:
+    PARSED_FLOW_SCHEMA = pa.schema([
+        ("destinationAddress", pa.string()),
+        ("destinationPort", pa.int64()),
+        ("protocol", pa.int64()),
+        ("protocolName", pa.string()),
+        ("sourceAddress", pa.string()),
+        ("internal_or_external_source", pa.string()),
+        ("internal_or_external_destination", pa.string()),
+        ("traffic_direction", pa.string()),
+        ("traffic_type", pa.string()),
+        ("security_list_ocids", pa.list_(pa.string())),
+        ("vnicsubnetocid", pa.string()),
+        ("vnicocid", pa.string()),
+        ("ingestedtime", pa.string())
+    ])
+
+
+def _integer_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _write_parquet_row_group(writer, records):
+    columns = {name: [record.get(name) for record in records] for name in PARSED_FLOW_SCHEMA.names}
+    for name in ("destinationPort", "protocol"):
+        columns[name] = [_integer_or_none(value) for value in columns[name]]
+    writer.write_table(pa.Table.from_pydict(columns, schema=PARSED_FLOW_SCHEMA))
+
+
+# Write parsed records to a binary file object and return how many were written
+def write_parsed_records(records, file_obj, output_format='ndjson.gz'):
+    record_count = 0
+    if output_format == 'ndjson.gz':
+        with gzip.GzipFile(fileobj=file_obj, mode='wb') as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(',', ':')).encode('utf-8') + b"\n")
+                record_count += 1
+    elif output_format == 'parquet':
+        if pa is None:
+            raise ValueError("Parquet output requires pyarrow")
+        writer = pq.ParquetWriter(file_obj, PARSED_FLOW_SCHEMA, compression='zstd')
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= PARSED_ROW_GROUP_SIZE:
+                _write_parquet_row_group(writer, batch)
+                record_count += len(batch)
+                batch = []
+        if batch:
+            _write_parquet_row_group(writer, batch)
+            record_count += len(batch)
+        writer.close()
+    else:
+        raise ValueError(f"Unsupported output format {output_format}, expected one of {PARSED_OUTPUT_FORMATS}")
+    return record_count
+
+
+# Yield the elements of a JSON array file one at a time, reading the file in chunks
+def iter_json_array(file_obj, chunk_size=1 << 20):
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ""
+    position = 0
+    started = False
+    exhausted = False
+    while True:
+        # Skip the opening bracket, separators and whitespace between elements
+        while position < len(buffer) and (buffer[position].isspace() or buffer[position] == ',' or (buffer[position] == '[' and not started)):
+            started = started or buffer[position] == '['
+            position += 1
+        if position < len(buffer):
+            if not started:
+                raise json.JSONDecodeError("Expected a JSON array", buffer, position)
+            if buffer[position] == ']':
+                return
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+            else:
+                # Only accept a value once the separator after it has been read; a number cut by the
+                # chunk boundary (e.g. "12" of "12.5" or "3" of "3e7") would otherwise be accepted early
+                following = end
+                while following < len(buffer) and buffer[following].isspace():
+                    following += 1
+                if following < len(buffer) and buffer[following] in ',]':
+                    yield value
+                    position = end
+                    continue
+                if exhausted:
+                    if following < len(buffer):
+                        raise json.JSONDecodeError("Expecting ',' delimiter", buffer, following)
+                    yield value
+                    position = end
+                    continue
+        elif exhausted:
+            if started:
+                raise json.JSONDecodeError("Unterminated JSON array", buffer, position)
+            return  # Empty file
+        # The next element is incomplete, so read more of the file
+        chunk = file_obj.read(chunk_size)
+        exhausted = not chunk
+        buffer = buffer[position:] + text_decoder.decode(chunk or b"", final=exhausted)
+        position = 0
+
+
+def is_parsed_output(name):
+    return name.endswith('.json') or any(name.endswith('.' + output_format) for output_format in PARSED_OUTPUT_FORMATS)
+
+
+# Yield the records of a parsed flow file, choosing the reader from the file name
+def iter_parsed_records(file_obj, name):
+    if name.endswith('.ndjson.gz'):
+        with gzip.GzipFile(fileobj=file_obj, mode='rb') as f:
+            for line in f:
+                if line.strip():
+                    yield _loads(line)
+    elif name.endswith('.parquet'):
+        if pq is None:
+            raise ValueError("Reading Parquet output requires pyarrow")
+        # Parquet needs random access, so a streamed download is read into memory first
+        if not file_obj.seekable():
+            file_obj = io.BytesIO(file_obj.read())
+        for batch in pq.ParquetFile(file_obj).iter_batches(batch_size=PARSED_ROW_GROUP_SIZE):
+            yield from batch.to_pylist()
+    elif name.endswith('.json'):
+        yield from iter_json_array(file_obj)
+    else:
+        raise ValueError(f"Unsupported parsed output {name}")
@@ -0,0 +1,241 @@
+import oci
+import datetime
+import ipaddress
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Search window and how it is split for parallel fetching
+SEARCH_WINDOW_DAYS = 13
+SLICE_HOURS = 6
+SLICE_WORKERS = 4
+PAGE_LIMIT = 500
+
+# Pages buffered per slice; together with SLICE_WORKERS this bounds the records held in memory
+QUEUED_PAGES_PER_SLICE = 2
+
+_SLICE_DONE = object()
+
+
+# Split [start_time, end_time) into slices, newest first so the stream keeps 'sort by datetime desc' order
+def time_slices(start_time, end_time, slice_length):
+    slices = []
+    slice_end = end_time
+    while slice_end > start_time:
+        slice_start = max(start_time, slice_end - slice_length)
+        slices.append((slice_start, slice_end))
+        slice_end = slice_start
+    return slices
+
+
+def _put(pages, item, cancelled):
+    # Block while the consumer is behind, but give up once the stream has been closed
+    while not cancelled.is_set():
+        try:
+            pages.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+# Fetch one time slice, following opc-next-page until the slice is exhausted
+def _fetch_slice(log_search_client, search_query, time_start, time_end, limit, pages, cancelled):
+    page = None
+    try:
+        while not cancelled.is_set():
+            response = log_search_client.search_logs(
+                search_logs_details=oci.loggingsearch.models.SearchLogsDetails(
+                    time_start=time_start,
+                    time_end=time_end,
+                    search_query=search_query
+                ),
+                limit=limit,
+                page=page,
+                retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY
+            )
+            _put(pages, response.data.results, cancelled)
+            page = response.next_page
+            if not page:
+                break
+    except Exception as e:
+        _put(pages, e, cancelled)
+    finally:
+        _put(pages, _SLICE_DONE, cancelled)
+
+
+# Stream every search result of the window. Up to max_workers slices are fetched concurrently,
+# each into a small bounded queue; slices are drained in order, so the output order is stable.
+def iter_search_results(log_search_client, search_query, days=SEARCH_WINDOW_DAYS, slice_hours=SLICE_HOURS,
+                        max_workers=SLICE_WORKERS, limit=PAGE_LIMIT):
+    end_time = datetime.datetime.utcnow()
+    start_time = end_time - datetime.timedelta(days=days)
+    slices = iter(time_slices(start_time, end_time, datetime.timedelta(hours=slice_hours)))
+
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+
+    def submit_next_slice():
+        time_slice = next(slices, None)
+        if time_slice is None:
+            return
+        pages = queue.Queue(maxsize=QUEUED_PAGES_PER_SLICE)
+        executor.submit(_fetch_slice, log_search_client, search_query, time_slice[0], time_slice[1], limit, pages, cancelled)
+        pending.append(pages)
+
+    try:
+        for _ in range(max_workers):
+            submit_next_slice()
+        while pending:
+            pages = pending.popleft()
+            while True:
+                item = pages.get()
+                if item is _SLICE_DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                for result in item:
+                    yield result
+            submit_next_slice()
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False)
+
+
+# Fields read by the validators, projected in the query so the rest of the log content stays server-side
+FLOW_LOG_FIELDS = {
+    "sourceAddress": "data.sourceAddress",
+    "sourcePort": "data.sourcePort",
+    "destinationAddress": "data.destinationAddress",
+    "destinationPort": "data.destinationPort",
+    "action": "data.action",
+    "protocolName": "data.protocolName",
+    "compartmentid": "oracle.compartmentid",
+    "resourceId": "oracle.resourceId",
+    "resourceType": "oracle.resourceType",
+    "vcnOcid": "oracle.vcnOcid",
+    "vnicocid": "oracle.vnicocid",
+    "vnicsubnetocid": "oracle.vnicsubnetocid",
+    "datetime": "datetime"
+}
+
+# Above this many wildcard patterns per CIDR the predicate is widened to the enclosing octet boundary
+MAX_DESTINATION_PATTERNS = 16
+
+
+def _quote(value):
+    return "'" + str(value).replace("'", "\\'") + "'"
+
+
+def _or(predicates):
+    if len(predicates) == 1:
+        return predicates[0]
+    return "(" + " or ".join(predicates) + ")"
+
+
+# Express an IPv4 CIDR as wildcard patterns on the dotted address. Prefixes that are not on an
+# octet boundary are expanded, or widened when that would take too many patterns; the predicate
+# may select a superset of the CIDR but never drops addresses inside it. IPv6 yields no patterns.
+def destination_patterns(cidr):
+    network = ipaddress.ip_network(cidr, strict=False)
+    if network.version != 4 or network.prefixlen == 0:
+        return None
+    if network.prefixlen == 32:
+        return [str(network.network_address)]
+
+    octet_prefix = -(-network.prefixlen // 8) * 8
+    if 2 ** (octet_prefix - network.prefixlen) > MAX_DESTINATION_PATTERNS:
+        octet_prefix -= 8
+        if octet_prefix == 0:
+            return None
+    if octet_prefix >= network.prefixlen:
+        blocks = network.subnets(new_prefix=octet_prefix)
+    else:
+        blocks = [network.supernet(new_prefix=octet_prefix)]
+    patterns = []
+    for block in blocks:
+        octets = str(block.network_address).split('.')[:octet_prefix // 8]
+        patterns.append('.'.join(octets) + '.*' if octet_prefix < 32 else '.'.join(octets))
+    return patterns
+
+
+# Build a Logging Search query that filters and projects server-side instead of in Python
+def build_flow_log_query(scopes, actions=('ACCEPT',), protocols=None, destination_cidrs=None,
+                         fields=FLOW_LOG_FIELDS, sort=True):
+    query = "search " + ", ".join(f'"{scope}"' for scope in scopes)
+
+    predicates = []
+    if actions:
+        predicates.append(_or([f"data.action = {_quote(action)}" for action in actions]))
+    if protocols:
+        predicates.append(_or([f"data.protocolName = {_quote(protocol)}" for protocol in protocols]))
+    if destination_cidrs:
+        patterns = []
+        for cidr in destination_cidrs:
+            cidr_patterns = destination_patterns(cidr)
+            if cidr_patterns is None:
+                patterns = None  # Some CIDR cannot be expressed, so leave destinations unfiltered
+                break
+            patterns.extend(cidr_patterns)
+        if patterns:
+            predicates.append(_or([f"data.destinationAddress = {_quote(pattern)}" for pattern in patterns]))
+    if predicates:
+        query += " | where " + " and ".join(predicates)
+
+    if sort:
+        query += " | sort by datetime desc"
+    if fields:
+        query += " | select " + ", ".join(f"{path} as {name}" for name, path in fields.items())
+    return query
+
+
+# Collapse repeated (source, destination, protocol, destination port, action) tuples into one entry
+# with an occurrence count and first/last seen timestamps. Insertion order follows the first occurrence.
+def aggregate_flow_record(flow_tuples, flow_log_record):
+    key = (flow_log_record["sourceAddress"], flow_log_record["destinationAddress"],
+           flow_log_record["protocolName"], flow_log_record["destinationPort"], flow_log_record["action"])
+    seen_at = flow_log_record.get("datetime")
+    flow_tuple = flow_tuples.get(key)
+    if flow_tuple is None:
+        flow_tuples[key] = {"record": flow_log_record, "count": 1, "first_seen": seen_at, "last_seen": seen_at}
+        return
+    flow_tuple["count"] += 1
+    if seen_at is not None:
+        if flow_tuple["first_seen"] is None or seen_at < flow_tuple["first_seen"]:
+            flow_tuple["first_seen"] = seen_at
+        if flow_tuple["last_seen"] is None or seen_at > flow_tuple["last_seen"]:
+            flow_tuple["last_seen"] = seen_at
+
+
+# Search results carry the log time as epoch milliseconds
+def format_seen(seen_at):
+    if isinstance(seen_at, (int, float)):
+        return datetime.datetime.utcfromtimestamp(seen_at / 1000).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    return seen_at
+
+
+# Flatten a search result into the flow log record used by the validators. Projected results
+# are already flat; full log content is unpacked as before.
+def flow_log_to_dict(log):
+    if 'logContent' not in log.data:
+        return {name: log.data.get(name) for name in FLOW_LOG_FIELDS}
+
+    log_data = log.data['logContent']['data']
+    oracle_data = log.data['logContent']['oracle']
+
+    return {
+        "sourceAddress": log_data.get('sourceAddress'),
+        "sourcePort": log_data.get('sourcePort'),
+        "destinationAddress": log_data.get('destinationAddress'),
+        "destinationPort": log_data.get('destinationPort'),
+        "action": log_data.get('action'),
+        "protocolName": log_data.get('protocolName'),
+        "compartmentid": oracle_data.get('compartmentid'),
+        "resourceId": oracle_data.get('resourceId'),
+        "resourceType": oracle_data.get('resourceType'),
+        "vcnOcid": oracle_data.get('vcnOcid'),
+        "vnicocid": oracle_data.get('vnicocid'),
+        "vnicsubnetocid": oracle_data.get('vnicsubnetocid'),
+        "datetime": log.data.get('datetime')
+    }
@@ -1,96 +1,173 @@
 import oci
-import sys
 import gzip
 import json
 import os
-import ipaddress
-import threading
-from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import tempfile
-import shutil
-
-# OCI configuration
-config = oci.config.from_file("~/.oci/config")  # Modify if your config file is located elsewhere
-object_storage_client = oci.object_storage.ObjectStorageClient(config)
-virtual_network_client = oci.core.VirtualNetworkClient(config)
-subnet_cache = {}
-security_list_cache = {}
+import re
+import multiprocessing
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from collections import deque
+import argparse
+import resource_cache
+import flow_log_parser
+import ip_classifier
+import ingest_manifest
+import multipart_upload
+
+# OCI configuration. The clients and the on-disk cache are created by init_clients() when the
+# script runs rather than on import, since spawned parse workers import this module again.
+OCI_CONFIG_FILE = "~/.oci/config"  # Modify if your config file is located elsewhere
+config = None
+object_storage_client = None
+virtual_network_client = None
+network_cache = None  # Persists across runs
+subnet_cache = resource_cache.SingleFlightCache()  # Shared by the worker threads, one lookup per OCID
+security_list_cache = resource_cache.SingleFlightCache()
+subnet_classifier = ip_classifier.IPClassifier()  # Subnet CIDRs compiled once, hot addresses cached
 namespace = "ociateam"  # OCI Object Storage namespace
 bucket_name = "Flow-Logs"  # Replace with your bucket name
 parsed_data_bucket_name = "parsed-flow-log-data"
 # Time filter (e.g., last 30 days)
 time_threshold = datetime.utcnow() - timedelta(days=30)
 
-# Private IP ranges
-PRIVATE_IP_RANGES = [
-    ipaddress.ip_network("10.0.0.0/8"),
-    ipaddress.ip_network("172.16.0.0/12"),
-    ipaddress.ip_network("192.168.0.0/16")
-]
-
-# Lock for thread-safe operations
-lock = threading.Lock()
-
-# List all objects in the bucket and group them by folders
-def list_log_files(client, namespace, bucket_name):
+# Number of prefixes listed concurrently by list_log_files
+LIST_WORKERS = 4
+
+# Pipeline stages: download/enrich threads and decode processes
+DOWNLOAD_WORKERS = 3
+PARSE_WORKERS = os.cpu_count() or 2
+PARSE_BLOCK_LINES = 5000
+MAX_PENDING_BLOCKS = 4
+
+# Subnet and security list tables written next to the parsed flow files; every run that parses
+# objects merges its entries into them
+SUBNET_TABLE_NAME = "subnets.json"
+SECURITY_LIST_TABLE_NAME = "security_lists.json"
+# Per-run tables (<prefix><run_id>.json) written by earlier versions, folded into the tables above
+LEGACY_SUBNET_TABLE_PREFIX = "subnets_"
+LEGACY_SECURITY_LIST_TABLE_PREFIX = "security_lists_"
+
+# Parsed flow files are written as gzip NDJSON ('ndjson.gz') or Parquet ('parquet')
+PARSED_OUTPUT_FORMAT = 'ndjson.gz'
+
+# The manifest is written back after this many completed objects, so an interrupted run keeps most of its progress
+MANIFEST_SAVE_EVERY = 50
+
+# Parse workers are spawned rather than forked: the pool starts its workers from download
+# threads, and forking while other threads hold OCI connection or SQLite cache locks can deadlock
+PARSE_MP_CONTEXT = "spawn"
+
+# Dates in object names / folder prefixes, e.g. 2024/10/17, 2024-10-17 or 20241017T0000Z
+FULL_DATE_PATTERN = re.compile(r'(20\d{2})[-/]?(\d{2})[-/]?(\d{2})')
+MONTH_PATTERN = re.compile(r'(?:^|/)(20\d{2})[-/](\d{2})/?$')
+YEAR_PATTERN = re.compile(r'(?:^|/)(20\d{2})/?$')
+
+def init_clients(config_file=OCI_CONFIG_FILE):
+    global config, object_storage_client, virtual_network_client, network_cache
+    config = oci.config.from_file(config_file)
+    object_storage_client = oci.object_storage.ObjectStorageClient(config)
+    virtual_network_client = oci.core.VirtualNetworkClient(config)
+    network_cache = resource_cache.ResourceCache(virtual_network_client)
+
+# List one level of the bucket under prefix, following next_start_with until the listing is complete
+def list_objects_all_pages(client, namespace, bucket_name, prefix=None, delimiter=None):
+    objects = []
+    prefixes = []
+    start = None
+    while True:
+        list_objects_response = client.list_objects(
+            namespace,
+            bucket_name,
+            prefix=prefix,
+            start=start,
+            delimiter=delimiter,
+            fields="name,size,etag,timeCreated",
+            retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY
+        )
+        objects.extend(list_objects_response.data.objects)
+        prefixes.extend(list_objects_response.data.prefixes or [])
+        start = list_objects_response.data.next_start_with
+        if not start:
+            return objects, prefixes
+
+# Latest date that anything under a folder prefix can belong to, or None if the prefix carries no date
+def latest_date_in_prefix(prefix):
+    match = FULL_DATE_PATTERN.search(prefix)
+    if match:
+        try:
+            return date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        except ValueError:
+            return None
+    match = MONTH_PATTERN.search(prefix)
+    if match and 1 <= int(match.group(2)) <= 12:
+        year, month = int(match.group(1)), int(match.group(2))
+        return date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    match = YEAR_PATTERN.search(prefix)
+    if match:
+        return date(int(match.group(1)), 12, 31)
+    return None
+
+def is_older_than_threshold(obj):
+    if obj.time_created is not None:
+        return obj.time_created.replace(tzinfo=None) < time_threshold
+    latest = latest_date_in_prefix(obj.name)
+    return latest is not None and latest < time_threshold.date()
+
+# List all log objects newer than time_threshold. The bucket is walked folder by folder with a
+# delimiter, each level fanned out over LIST_WORKERS threads and fully paginated. Folders whose
+# date is before the time window are pruned before they are listed.
+def list_log_files(client, namespace, bucket_name, max_workers=LIST_WORKERS):
     objects = []
-    list_objects_response = client.list_objects(namespace, bucket_name)
-    for obj in list_objects_response.data.objects:
-        if not obj.name.endswith("/"):  # Exclude folders
-            objects.append(obj)
-    return objects
-
-# Download and extract .log.gz files
-def download_and_extract_file(client, namespace, bucket_name, object_name):
+    pending_prefixes = [None]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending_prefixes:
+            listings = executor.map(
+                lambda prefix: list_objects_all_pages(client, namespace, bucket_name, prefix=prefix, delimiter='/'),
+                pending_prefixes
+            )
+            next_prefixes = []
+            for level_objects, level_prefixes in listings:
+                for obj in level_objects:
+                    if not obj.name.endswith("/") and not is_older_than_threshold(obj):  # Exclude folders and old objects
+                        objects.append(obj)
+                for prefix in level_prefixes:
+                    latest = latest_date_in_prefix(prefix)
+                    if latest is None or latest >= time_threshold.date():
+                        next_prefixes.append(prefix)
+            pending_prefixes = next_prefixes
+    return sorted(objects, key=lambda obj: obj.name)
+
+# Stream the lines of a log object straight from the get_object response, decompressing on the fly.
+# Nothing is written to disk and only the current block of the object is held in memory.
+def stream_log_lines(client, namespace, bucket_name, object_name):
     file_stream = client.get_object(namespace, bucket_name, object_name).data.raw
-    local_file_name = os.path.join(r'C:\Security\Blogs\Security_List\Logs\downloads', object_name.split('/')[-1])
-
-    with open(local_file_name, 'wb') as f:
-        f.write(file_stream.read())
-
-    # Extract the .log.gz file
-    if local_file_name.endswith('.gz'):
-        with gzip.open(local_file_name, 'rb') as f_in:
-            extracted_file = local_file_name.replace('.gz', '')
-            with open(extracted_file, 'wb') as f_out:
-                f_out.write(f_in.read())
-        os.remove(local_file_name)  # Remove the original .gz file
-        return extracted_file
-    return local_file_name
-
-# Determine if an IP is internal or external
-def is_internal_ip(ip):
     try:
-        ip_obj = ipaddress.ip_address(ip)
-        for net in PRIVATE_IP_RANGES:
-            if ip_obj in net:
-                return "internal"
-        return "external"
-    except ValueError:
-        return "invalid"
-
+        if object_name.endswith('.gz'):
+            with gzip.GzipFile(fileobj=file_stream, mode='rb') as f_in:
+                for line in f_in:
+                    yield line
+        else:
+            for line in file_stream:
+                yield line
+    finally:
+        file_stream.close()
+
+# Returns (cidr, security list ids), or (None, None) when the subnet cannot be read
 def get_subnet_cidr(subnet_ocid):
-    if subnet_ocid in subnet_cache:
-        return subnet_cache[subnet_ocid]
+    return subnet_cache.get(subnet_ocid, load_subnet_cidr) or (None, None)
+
+def load_subnet_cidr(subnet_ocid):
     try:
-        subnet_response = virtual_network_client.get_subnet(subnet_ocid)
-        subnet_cidr = subnet_response.data.cidr_block
-        subnet_security_list = subnet_response.data.security_list_ids
-        subnet_cache[subnet_ocid] = (subnet_cidr, subnet_security_list)
-        return subnet_cidr, subnet_security_list
+        subnet = network_cache.get_subnet(subnet_ocid)
+        subnet_classifier.add_subnets([subnet.cidr_block])
+        return subnet.cidr_block, subnet.security_list_ids
     except oci.exceptions.ServiceError as e:
         print(f"Failed to get subnet CIDR: {e}")
         return None
 
 # Check if the IP is part of the subnet CIDR
 def is_ip_in_subnet(ip, cidr):
-    try:
-        ip_obj = ipaddress.ip_address(ip)
-        subnet = ipaddress.ip_network(cidr)
-        return ip_obj in subnet
-    except ValueError:
-        return False
+    return subnet_classifier.in_subnet(ip, cidr)
 
 def extract_ingress_rule_attributes(rule):
     return {
@@ -152,163 +229,209 @@ def extract_egress_rule_attributes(rule):
         } if rule.udp_options else None
     }
 
+# Details of every readable security list; lists that cannot be read are left out
 def get_security_list_details(security_list_ids):
-    if tuple(security_list_ids) in security_list_cache:
-        return security_list_cache[tuple(security_list_ids)]
     security_list_details = []
     for security_list_id in security_list_ids:
-        try:
-            security_list_response = virtual_network_client.get_security_list(security_list_id)
-            security_list_data = security_list_response.data
-            ingress_rules = [extract_ingress_rule_attributes(rule) for rule in security_list_data.ingress_security_rules]
-            egress_rules = [extract_egress_rule_attributes(rule) for rule in security_list_data.egress_security_rules]
-            security_list_details.append({
-                "display_name": security_list_data.display_name,
-                "security_list_ocid": security_list_data.id,
-                "ingress_security_rules": ingress_rules,
-                "egress_security_rules": egress_rules
-            })
-        except oci.exceptions.ServiceError as e:
-            print(f"Failed to get security list: {e}")
-            continue
-    security_list_cache[tuple(security_list_ids)] = security_list_details
+        details = security_list_cache.get(security_list_id, load_security_list_details)
+        if details is not None:
+            security_list_details.append(details)
     return security_list_details
 
-# Parse the JSON data and filter based on action 'ACCEPT'
-def parse_log_file(file_name):
-    result_list = []
-    with open(file_name, 'r') as f:
-        for line in f:
-            try:
-                log_entry = json.loads(line)
-                # Filter based on ingestedtime (last 30 days)
-                ingested_time = log_entry['oracle']['ingestedtime']
-                try:
-                    ingested_datetime = datetime.strptime(ingested_time, "%Y-%m-%dT%H:%M:%S.%fZ")
-                except ValueError:
-                    # If the above fails, try without microseconds
-                    ingested_datetime = datetime.strptime(ingested_time, "%Y-%m-%dT%H:%M:%SZ")
-                
-                if ingested_datetime < time_threshold:
-                    continue
-
-                # Filter for 'ACCEPT' action only
-                if log_entry['data'].get('action') == 'ACCEPT':
-                    # Extract variables
-                    destination_address = log_entry['data'].get('destinationAddress', 'N/A')
-                    destination_port = log_entry['data'].get('destinationPort', 'N/A')
-                    protocol = log_entry['data'].get('protocol', 'N/A')
-                    protocol_name = log_entry['data'].get('protocolName', 'N/A')
-                    source_address = log_entry['data'].get('sourceAddress', 'N/A')
-                    vnic_subnet_ocid = log_entry['oracle'].get('vnicsubnetocid', 'N/A')
-                    oracle_data = log_entry.get('oracle', {})
-
-                    # Determine if the sourceAddress and destinationAddress are internal or external
-                    internal_or_external_source = is_internal_ip(source_address)
-                    internal_or_external_destination = is_internal_ip(destination_address)
-
-                    # Check if sourceAddress or destinationAddress matches subnet CIDR
-                    traffic_direction = "N/A"
-                    traffic_type = "external traffic"
-                    security_list_details = []
-                    if vnic_subnet_ocid != 'N/A':
-                        subnet_cidr, subnet_security_list = get_subnet_cidr(vnic_subnet_ocid)
-
-                        # Fetch security list details for all security lists in the subnet
-                        if subnet_security_list:
-                            security_list_details = get_security_list_details(subnet_security_list)
-
-                        # Determine traffic direction (egress, ingress) based on source or destination match
-                        if subnet_cidr:
-                            if is_ip_in_subnet(source_address, subnet_cidr):
-                                traffic_direction = "egress"
-                            elif is_ip_in_subnet(destination_address, subnet_cidr):
-                                traffic_direction = "ingress"
-
-                        # Check if both source and destination addresses are internal
-                        if internal_or_external_source == "internal" and internal_or_external_destination == "internal":
-                            traffic_type = "internal traffic"
-
-                    # Add extracted data to the result list, including security list details
-                    result_list.append({
-                        "destinationAddress": destination_address,
-                        "destinationPort": destination_port,
-                        "protocol": protocol,
-                        "protocolName": protocol_name,
-                        "sourceAddress": source_address,
-                        "internal_or_external_source": internal_or_external_source,
-                        "internal_or_external_destination": internal_or_external_destination,
-                        "traffic_direction": traffic_direction,
-                        "traffic_type": traffic_type,
-                        "security_lists": security_list_details,  # Contains details of all security lists
-                        "oracle": oracle_data
-                    })
-            except json.JSONDecodeError:
-                print(f"Skipping invalid JSON: {line}")
-
-    return result_list
-
-# Write the result to JSON and Excel
-def write_output_to_files(output_data, log_file_name):
-    # Use the lock to ensure thread-safe file writing
-    with lock:
-        # Write to JSON file
-        json_output_file = f'C:\\Security\\Blogs\\Security_List\\Logs\\parsed_data\\{log_file_name}_output.json'
-        with open(json_output_file, 'w') as json_file:
-            json.dump(output_data, json_file, indent=4)
-
-def upload_to_object_storage(file_path, bucket_name, object_name):
-    with open(file_path, 'rb') as f:
-        object_storage_client.put_object(
-            namespace,
-            bucket_name,
-            object_name,
-            f
-        )
-
-def write_output_to_bucket(parsed_data, bucket_name, thread_id):
-    output_file_name = f"parsed_data_{thread_id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.json"
-    temp_file_path = os.path.join(tempfile.gettempdir(), output_file_name)
-
-    # Write to a temporary file first
-    with open(temp_file_path, 'w') as f:
-        json.dump(parsed_data, f, indent=4)
+def load_security_list_details(security_list_id):
+    try:
+        security_list_data = network_cache.get_security_list(security_list_id)
+    except oci.exceptions.ServiceError as e:
+        print(f"Failed to get security list: {e}")
+        return None
+    ingress_rules = [extract_ingress_rule_attributes(rule) for rule in security_list_data.ingress_security_rules]
+    egress_rules = [extract_egress_rule_attributes(rule) for rule in security_list_data.egress_security_rules]
+    return {
+        "display_name": security_list_data.display_name,
+        "security_list_ocid": security_list_data.id,
+        "ingress_security_rules": ingress_rules,
+        "egress_security_rules": egress_rules
+    }
 
-    # Upload to Object Storage
-    upload_to_object_storage(temp_file_path, bucket_name, output_file_name)
+# Fill in traffic direction, traffic type and security list OCIDs of a decoded record. This
+# needs the subnet lookups, so it runs in the parent process.
+def enrich_flow_record(record):
+    vnic_subnet_ocid = record["vnicsubnetocid"]
+    if vnic_subnet_ocid == 'N/A':
+        return record
+
+    subnet_cidr, subnet_security_list = get_subnet_cidr(vnic_subnet_ocid)
+
+    # Security list details are written once per run by merge_run_tables
+    if subnet_security_list:
+        record["security_list_ocids"] = subnet_security_list
+
+    # Determine traffic direction (egress, ingress) based on source or destination match
+    if subnet_cidr:
+        if is_ip_in_subnet(record["sourceAddress"], subnet_cidr):
+            record["traffic_direction"] = "egress"
+        elif is_ip_in_subnet(record["destinationAddress"], subnet_cidr):
+            record["traffic_direction"] = "ingress"
+
+    # Check if both source and destination addresses are internal
+    if record["internal_or_external_source"] == "internal" and record["internal_or_external_destination"] == "internal":
+        record["traffic_type"] = "internal traffic"
+    return record
+
+# Parse flow log lines in this process and yield the enriched ACCEPT records
+def parse_log_lines(lines):
+    for record in flow_log_parser.decode_log_lines(lines, time_threshold):
+        yield enrich_flow_record(record)
+
+# Staged parse of one object: this (I/O) thread streams the object and cuts it into blocks of
+# PARSE_BLOCK_LINES lines, the process pool decodes the blocks, and the results are enriched here
+# in order. At most MAX_PENDING_BLOCKS blocks per object are in flight, which bounds memory.
+def parse_log_lines_in_pool(lines, parse_executor):
+    pending = deque()
+    block = []
+    for line in lines:
+        block.append(line)
+        if len(block) >= PARSE_BLOCK_LINES:
+            pending.append(parse_executor.submit(flow_log_parser.decode_log_lines, block, time_threshold))
+            block = []
+            while len(pending) >= MAX_PENDING_BLOCKS:
+                for record in pending.popleft().result():
+                    yield enrich_flow_record(record)
+    if block:
+        pending.append(parse_executor.submit(flow_log_parser.decode_log_lines, block, time_threshold))
+    while pending:
+        for record in pending.popleft().result():
+            yield enrich_flow_record(record)
+
+# Output name derived from the log object, so reprocessing an object replaces its earlier output
+def parsed_output_name(obj_name, output_format=PARSED_OUTPUT_FORMAT):
+    base_name = obj_name[:-len('.log.gz')] if obj_name.endswith('.log.gz') else obj_name
+    return f"parsed_data_{base_name.replace('/', '_')}.{output_format}"
+
+# Stream the records into the bucket as they are parsed: compressed batches go out as multipart
+# upload parts, so neither a temporary file nor the whole output is ever held locally
+def write_output_to_bucket(parsed_data, bucket_name, output_file_name, output_format=PARSED_OUTPUT_FORMAT):
+    with multipart_upload.MultipartUploadStream(object_storage_client, namespace, bucket_name, output_file_name) as upload:
+        return flow_log_parser.write_parsed_records(parsed_data, upload, output_format)
+
+# Merge entries into a table and write it back. Per-run tables left by earlier versions are folded
+# in first (oldest first, so newer entries win) and then deleted, so readers only ever load one object.
+def merge_table(bucket_name, table_name, legacy_prefix, entries):
+    legacy_tables = sorted(obj.name for obj in oci.pagination.list_call_get_all_results(
+        object_storage_client.list_objects, namespace, bucket_name, prefix=legacy_prefix
+    ).data.objects)
+    table = {}
+    for legacy_table in legacy_tables:
+        table.update(json.loads(object_storage_client.get_object(namespace, bucket_name, legacy_table).data.content))
+    try:
+        table.update(json.loads(object_storage_client.get_object(namespace, bucket_name, table_name).data.content))
+    except oci.exceptions.ServiceError as e:
+        if e.status != 404:
+            raise
+    table.update(entries)
+    object_storage_client.put_object(namespace, bucket_name, table_name, json.dumps(table, indent=4).encode('utf-8'))
+    for legacy_table in legacy_tables:
+        object_storage_client.delete_object(namespace, bucket_name, legacy_table)
+    return len(table)
+
+# Merge the subnets and security lists seen in this run into the tables: subnets.json maps subnet
+# OCIDs to their CIDR and security list OCIDs, security_lists.json maps security list OCIDs to their
+# details. Flow records refer to both by OCID.
+def merge_run_tables(bucket_name):
+    subnets = {
+        subnet_ocid: {"cidr_block": subnet_cidr, "security_list_ids": subnet_security_list}
+        for subnet_ocid, (subnet_cidr, subnet_security_list) in subnet_cache.items()
+    }
+    security_list_ids = sorted({security_list_id for subnet in subnets.values() for security_list_id in subnet["security_list_ids"] or []})
+    security_lists = {details["security_list_ocid"]: details for details in get_security_list_details(security_list_ids)}
 
-    # Clean up the temporary file
-    os.remove(temp_file_path)
+    subnet_count = merge_table(bucket_name, SUBNET_TABLE_NAME, LEGACY_SUBNET_TABLE_PREFIX, subnets)
+    security_list_count = merge_table(bucket_name, SECURITY_LIST_TABLE_NAME, LEGACY_SECURITY_LIST_TABLE_PREFIX, security_lists)
+    return len(subnets), len(security_lists), subnet_count, security_list_count
 
 # Process a single log file
-def process_single_log_file(client, namespace, bucket_name, obj_name, thread_id):
-    log_file_name = obj_name.split('/')[-1].replace('.gz', '')  # Extract log file name
-    extracted_file = download_and_extract_file(client, namespace, bucket_name, obj_name)
-    parsed_data = parse_log_file(extracted_file)
-
-    # Write each thread's output to a separate file
-    write_output_to_bucket(parsed_data, parsed_data_bucket_name, thread_id)
-
-    os.remove(extracted_file)  # Clean up extracted files
-    return parsed_data
-
-def process_flow_logs_in_parallel():
-    objects = list_log_files(object_storage_client, namespace, bucket_name)
-    extracted_data = []
-
-    # Use ThreadPoolExecutor for parallel processing of files
-    with ThreadPoolExecutor(max_workers=3) as executor:
+def process_single_log_file(client, namespace, bucket_name, obj_name, parse_executor=None, output_format=PARSED_OUTPUT_FORMAT):
+    # Download, decompress and parse as one stream; records flow straight into the output file
+    lines = stream_log_lines(client, namespace, bucket_name, obj_name)
+    if parse_executor is None:
+        parsed_data = parse_log_lines(lines)
+    else:
+        parsed_data = parse_log_lines_in_pool(lines, parse_executor)
+
+    # Each log object gets its own output file
+    return write_output_to_bucket(parsed_data, parsed_data_bucket_name, parsed_output_name(obj_name, output_format), output_format)
+
+# An object reprocessed in another output format leaves its old output behind; remove it so
+# readers do not count the same flows twice
+def remove_previous_output(manifest, obj, output):
+    previous = manifest.processed.get(obj.name)
+    if previous is None or previous["output"] == output:
+        return
+    try:
+        object_storage_client.delete_object(namespace, parsed_data_bucket_name, previous["output"])
+    except oci.exceptions.ServiceError as e:
+        if e.status != 404:
+            print(f"Failed to remove previous output {previous['output']}: {e}")
+
+def process_flow_logs_in_parallel(download_workers=DOWNLOAD_WORKERS, parse_workers=PARSE_WORKERS, reprocess_all=False,
+                                  output_format=PARSED_OUTPUT_FORMAT, refresh_cache=False):
+    manifest = ingest_manifest.IngestManifest(object_storage_client, namespace, parsed_data_bucket_name).load()
+    objects = [obj for obj in list_log_files(object_storage_client, namespace, bucket_name) if obj.name.endswith('.log.gz')]
+    pending = objects if reprocess_all else manifest.pending(objects)
+    print(f"{len(pending)} of {len(objects)} log files are new, changed or queued for retry")
+    record_count = 0
+    failed_count = 0
+    if refresh_cache:
+        network_cache.clear()
+    vcn_count, refreshed = network_cache.revalidate()
+    print(f"Revalidated {refreshed} cached subnets and security lists in {vcn_count} VCNs")
+
+    # Threads download and enrich objects; the process pool does the CPU-bound decoding
+    with ProcessPoolExecutor(max_workers=parse_workers, mp_context=multiprocessing.get_context(PARSE_MP_CONTEXT)) as parse_executor, ThreadPoolExecutor(max_workers=download_workers) as executor:
         futures = {
-            executor.submit(process_single_log_file, object_storage_client, namespace, bucket_name, obj.name, idx): obj
-            for idx, obj in enumerate(objects) if obj.name.endswith('.log.gz')
+            executor.submit(process_single_log_file, object_storage_client, namespace, bucket_name, obj.name, parse_executor, output_format): obj
+            for obj in pending
         }
 
-        for future in as_completed(futures):
+        for completed, future in enumerate(as_completed(futures), 1):
+            obj = futures[future]
             try:
-                data = future.result()
-                extracted_data.extend(data)
+                records = future.result()
+                record_count += records
+                output = parsed_output_name(obj.name, output_format)
+                remove_previous_output(manifest, obj, output)
+                manifest.mark_processed(obj, output, records)
             except Exception as e:
-                print(f"Error processing file: {e}")
+                print(f"Error processing file {obj.name}, queued for retry: {e}")
+                manifest.mark_failed(obj, e)
+                failed_count += 1
+            if completed % MANIFEST_SAVE_EVERY == 0:
+                manifest.save()
+
+    manifest.save()
+    print(f"Parsed {record_count} ACCEPT records from {len(futures)} log files")
+    print(f"{failed_count} log files failed and are in the retry queue ({len(manifest.retry)} queued in total)")
+
+    if len(futures) > failed_count:
+        run_subnets, run_security_lists, subnet_count, security_list_count = merge_run_tables(parsed_data_bucket_name)
+        print(f"Merged {run_subnets} subnets and {run_security_lists} security lists into the tables "
+              f"({subnet_count} subnets and {security_list_count} security lists in total)")
+    else:
+        print("No log files were parsed, so the subnet and security list tables are unchanged")
+    print(f"Subnet lookups: {subnet_cache.stats()}")
+    print(f"Security list lookups: {security_list_cache.stats()}")
 
 if __name__ == "__main__":
-    process_flow_logs_in_parallel()
+    parser = argparse.ArgumentParser(description="Parse VCN flow logs exported to Object Storage")
+    parser.add_argument("--download-workers", type=int, default=DOWNLOAD_WORKERS, help="Threads downloading and enriching log objects")
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS, help="Processes decoding flow log lines")
+    parser.add_argument("--reprocess-all", action="store_true", help="Ignore the manifest and parse every log file again")
+    parser.add_argument("--output-format", choices=flow_log_parser.PARSED_OUTPUT_FORMATS, default=PARSED_OUTPUT_FORMAT, help="Format of the parsed flow files")
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help="Empty the subnet and security list cache first. Without it, entries older than "
+                             f"{resource_cache.REVALIDATE_AFTER_SECONDS // 3600} hours are revalidated per VCN, and entries in a VCN "
+                             f"that cannot be listed are served for up to {resource_cache.CACHE_TTL_SECONDS // 86400} days")
+    args = parser.parse_args()
+
+    init_clients()
+    process_flow_logs_in_parallel(args.download_workers, args.parse_workers, args.reprocess_all, args.output_format, args.refresh_cache)
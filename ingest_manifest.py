@@ -0,0 +1,81 @@
+import json
+import threading
+from datetime import datetime
+import oci
+
+# Object holding the manifest, stored next to the parsed output
+MANIFEST_OBJECT_NAME = "manifest.json"
+# An object that failed this many runs in a row stays in the retry queue but is no longer picked up
+# until its etag changes
+MAX_ATTEMPTS = 5
+
+
+class IngestManifest:
+    # Checkpoint of the log objects that have been parsed, so a rerun only processes objects that
+    # are new or whose etag changed. Entries are:
+    #   processed[object name] = {"etag", "processed_at", "output", "records"}
+    #   retry[object name] = {"etag", "attempts", "failed_at", "error"}
+    # Objects that fail are moved to the retry queue and are retried first on the next run.
+    def __init__(self, client, namespace, bucket_name, object_name=MANIFEST_OBJECT_NAME, max_attempts=MAX_ATTEMPTS):
+        self.client = client
+        self.namespace = namespace
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.processed = {}
+        self.retry = {}
+
+    def load(self):
+        try:
+            response = self.client.get_object(self.namespace, self.bucket_name, self.object_name)
+        except oci.exceptions.ServiceError as e:
+            if e.status == 404:
+                return self  # First run
+            raise
+        manifest = json.loads(response.data.content)
+        self.processed = manifest.get("processed", {})
+        self.retry = manifest.get("retry", {})
+        return self
+
+    def save(self):
+        with self.lock:
+            body = json.dumps({"processed": self.processed, "retry": self.retry}, indent=1, sort_keys=True)
+        self.client.put_object(self.namespace, self.bucket_name, self.object_name, body.encode('utf-8'))
+
+    # Objects that still need to be parsed: queued retries first, then new or changed objects
+    def pending(self, objects):
+        retries = []
+        fresh = []
+        with self.lock:
+            for obj in objects:
+                entry = self.processed.get(obj.name)
+                if entry is not None and entry["etag"] == obj.etag:
+                    continue
+                failure = self.retry.get(obj.name)
+                if failure is None or failure["etag"] != obj.etag:
+                    fresh.append(obj)
+                elif failure["attempts"] < self.max_attempts:
+                    retries.append(obj)
+        return retries + fresh
+
+    def mark_processed(self, obj, output, records):
+        with self.lock:
+            self.processed[obj.name] = {
+                "etag": obj.etag,
+                "processed_at": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "output": output,
+                "records": records
+            }
+            self.retry.pop(obj.name, None)
+
+    def mark_failed(self, obj, error):
+        with self.lock:
+            failure = self.retry.get(obj.name)
+            attempts = failure["attempts"] + 1 if failure is not None and failure["etag"] == obj.etag else 1
+            self.retry[obj.name] = {
+                "etag": obj.etag,
+                "attempts": attempts,
+                "failed_at": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "error": str(error)
+            }
@@ -0,0 +1,116 @@
+import bisect
+import functools
+import ipaddress
+from rule_engine import np, parse_address
+
+# RFC 1918 ranges; addresses inside them are "internal"
+PRIVATE_IP_RANGES = ["10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"]
+
+# Parsed addresses kept per classifier; flow logs repeat a small set of hot addresses
+ADDRESS_CACHE_SIZE = 65536
+
+
+# Merge CIDRs into sorted, non-overlapping (start, end) integer intervals per IP version
+def _merge_intervals(cidrs):
+    intervals = {4: [], 6: []}
+    for cidr in cidrs:
+        network = ipaddress.ip_network(cidr)
+        intervals[network.version].append((int(network.network_address), int(network.broadcast_address)))
+    merged = {}
+    for version, ranges in intervals.items():
+        starts, ends = [], []
+        for start, end in sorted(ranges):
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        merged[version] = (starts, ends)
+    return merged
+
+
+class IPClassifier:
+    # Classifies addresses as "internal" (inside one of the given ranges), "external" or "invalid",
+    # and tests subnet membership, without building ipaddress objects per record. The ranges are
+    # compiled into sorted integer intervals once; subnet CIDRs are compiled the first time they are
+    # seen (or up front with add_subnets); parsed addresses go through a bounded LRU.
+    def __init__(self, internal_ranges=PRIVATE_IP_RANGES, cache_size=ADDRESS_CACHE_SIZE):
+        self.intervals = _merge_intervals(internal_ranges)
+        self.subnets = {}
+        self.parse = functools.lru_cache(maxsize=cache_size)(parse_address)
+        if np is not None:
+            starts, ends = self.intervals[4]
+            self._ipv4_arrays = (np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64))
+
+    def _is_inside(self, version, value):
+        starts, ends = self.intervals[version]
+        position = bisect.bisect_right(starts, value) - 1
+        return position >= 0 and value <= ends[position]
+
+    def classify(self, address):
+        try:
+            parsed = self.parse(address)
+        except TypeError:  # Unhashable values cannot be addresses
+            return "invalid"
+        if parsed is None:
+            return "invalid"
+        return "internal" if self._is_inside(*parsed) else "external"
+
+    # Classify a whole batch of addresses (e.g. every source address of a file). Each distinct
+    # address is parsed once and IPv4 addresses are looked up together with NumPy when available.
+    def classify_batch(self, addresses):
+        labels = {}
+        ipv4_addresses, ipv4_values = [], []
+        for address in addresses:
+            if address in labels:
+                continue
+            try:
+                parsed = self.parse(address)
+            except TypeError:
+                parsed = None
+            if parsed is None:
+                labels[address] = "invalid"
+            elif parsed[0] == 4 and np is not None:
+                labels[address] = None
+                ipv4_addresses.append(address)
+                ipv4_values.append(parsed[1])
+            else:
+                labels[address] = "internal" if self._is_inside(*parsed) else "external"
+
+        if ipv4_addresses:
+            starts, ends = self._ipv4_arrays
+            values = np.array(ipv4_values, dtype=np.int64)
+            positions = np.searchsorted(starts, values, side='right') - 1
+            inside = (positions >= 0) & (values <= ends[np.maximum(positions, 0)]) if len(starts) else np.zeros(len(values), dtype=bool)
+            for address, is_inside in zip(ipv4_addresses, inside.tolist()):
+                labels[address] = "internal" if is_inside else "external"
+        return [labels[address] for address in addresses]
+
+    # Compile subnet CIDRs ahead of the records that refer to them
+    def add_subnets(self, cidrs):
+        for cidr in cidrs:
+            self._subnet(cidr)
+
+    def _subnet(self, cidr):
+        compiled = self.subnets.get(cidr)
+        if compiled is None:
+            try:
+                network = ipaddress.ip_network(cidr)
+                compiled = (network.version, int(network.network_address), int(network.broadcast_address))
+            except (TypeError, ValueError):
+                compiled = ()  # Not a valid CIDR, so nothing is inside it
+            self.subnets[cidr] = compiled
+        return compiled
+
+    def in_subnet(self, address, cidr):
+        compiled = self._subnet(cidr)
+        if not compiled:
+            return False
+        try:
+            parsed = self.parse(address)
+        except TypeError:
+            return False
+        if parsed is None:
+            return False
+        version, low, high = compiled
+        return parsed[0] == version and low <= parsed[1] <= high
@@ -1,105 +1,229 @@
 import json
+import os
+import argparse
 import oci
 import itertools
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import flow_log_parser
+import flow_aggregator
+import sketches
 
-# OCI configuration
-config = oci.config.from_file("~/.oci/config")  # Modify if your config file is located elsewhere
-object_storage_client = oci.object_storage.ObjectStorageClient(config)
+# OCI configuration. The client is created by init_clients(): in the parent from __main__, and
+# once in each read worker, since an OCI client and its pooled connections cannot be shared
+# across processes
+OCI_CONFIG_FILE = "~/.oci/config"  # Modify if your config file is located elsewhere
+config = None
+object_storage_client = None
 namespace = "ociateam"  # OCI Object Storage namespace
 bucket_name = "parsed-flow-log-data"  # Bucket name containing JSON files
+results_bucket_name = "final_results"  # Bucket receiving one JSON file per subnet
 
-# Create a dictionary to store the extracted data
-data_dict = {}
+# Map: parsed files are read and aggregated in parallel processes. Reduce: the partial results are
+# merged in the parent. The per-subnet results are then uploaded concurrently.
+READ_WORKERS = os.cpu_count() or 2
+UPLOAD_WORKERS = 8
+# Read workers are spawned, so they never inherit the parent's client or its open connections
+READ_MP_CONTEXT = "spawn"
 
-# List all objects in the bucket
-objects = object_storage_client.list_objects(namespace, bucket_name).data.objects
+PROTOCOL_KEYS = ['TCP_Internal', 'TCP_External', 'UDP_Internal', 'UDP_External']
+# Ingress TCP/UDP occurrences are counted per (subnet, protocol/source type, source, destination, port)
+KEY_FIELDS = ['vnicsubnetocid', 'protocol_key', 'sourceAddress', 'destinationAddress', 'destinationPort']
 
-# Loop through all the JSON files in the bucket
-for obj in objects:
-    if obj.name.endswith('.json'):
-        # Get the JSON file from Object Storage
+# Approximate mode (--approximate): per subnet and protocol, port counts stay exact, tuple counts go
+# to a Count-Min sketch that keeps the top_k tuples, and distinct sources per port to HyperLogLogs,
+# so memory no longer grows with the number of sources
+SketchSettings = namedtuple('SketchSettings', ['epsilon', 'delta', 'top_k', 'hll_error'])
+
+class SketchAggregate:
+    def __init__(self, settings):
+        self.settings = settings
+        self.subnets = {}
+
+    def _entry(self, vnicsubnetocid, protocol_key):
+        key = (vnicsubnetocid, protocol_key)
+        entry = self.subnets.get(key)
+        if entry is None:
+            entry = {
+                'port_counts': {},
+                'hitters': sketches.HeavyHitters(self.settings.top_k, self.settings.epsilon, self.settings.delta),
+                'sources': {}
+            }
+            self.subnets[key] = entry
+        return entry
+
+    def add(self, key_values):
+        vnicsubnetocid, protocol_key, source_address, destination_address, destination_port = key_values
+        entry = self._entry(vnicsubnetocid, protocol_key)
+        entry['port_counts'][destination_port] = entry['port_counts'].get(destination_port, 0) + 1
+        entry['hitters'].add((source_address, destination_address, destination_port))
+        sources = entry['sources'].get(destination_port)
+        if sources is None:
+            sources = entry['sources'][destination_port] = sketches.HyperLogLog(self.settings.hll_error)
+        sources.add(source_address)
+
+    def merge(self, other):
+        for (vnicsubnetocid, protocol_key), other_entry in other.subnets.items():
+            entry = self._entry(vnicsubnetocid, protocol_key)
+            for port, count in other_entry['port_counts'].items():
+                entry['port_counts'][port] = entry['port_counts'].get(port, 0) + count
+            entry['hitters'].merge(other_entry['hitters'])
+            for port, sources in other_entry['sources'].items():
+                if port in entry['sources']:
+                    entry['sources'][port].merge(sources)
+                else:
+                    entry['sources'][port] = sources
+        return self
+
+def init_clients(config_file=OCI_CONFIG_FILE):
+    global config, object_storage_client
+    config = oci.config.from_file(config_file)
+    object_storage_client = oci.object_storage.ObjectStorageClient(config)
+
+# Subnet details are kept in one table (subnets.json) that every parsing run merges into, and flow
+# records only carry the subnet OCID, so the table is read the first time it is needed
+SUBNET_TABLE_NAME = "subnets.json"
+# Buckets not yet written by a merging run only hold per-run tables (subnets_<run_id>.json)
+LEGACY_SUBNET_TABLE_PREFIX = "subnets_"
+subnet_table = None
+
+def get_subnet_details(vnicsubnetocid):
+    global subnet_table
+    if subnet_table is None:
         try:
-            file_stream = object_storage_client.get_object(namespace, bucket_name, obj.name).data.raw
-            data = json.load(file_stream)
-        
-            # Loop through each item in the data
-            for item in data:
-                # Filter data based on traffic direction
-                if item.get('traffic_direction') == 'ingress':
-                    # Get the VNIC subnet OCID
-                    vnicsubnetocid = item['oracle']['vnicsubnetocid']
-                    
-                    # Get the protocolName and destinationPort
-                    protocol_name = item['protocolName']
-                    destination_port = item['destinationPort']
-                    internal_or_external_source = item['internal_or_external_source']
-                    source_address = item['sourceAddress']
-                    destination_address = item.get('destinationAddress')  # New field
-
-                    # Check if protocolName is TCP or UDP
-                    if protocol_name in ['TCP', 'UDP']:
-                        # Add the data to the dictionary
-                        if vnicsubnetocid not in data_dict:
-                            data_dict[vnicsubnetocid] = {
-                                'TCP_Internal': {'ports': set(), 'port_counts': {}, 'records': {}},
-                                'TCP_External': {'ports': set(), 'port_counts': {}, 'records': {}},
-                                'UDP_Internal': {'ports': set(), 'port_counts': {}, 'records': {}},
-                                'UDP_External': {'ports': set(), 'port_counts': {}, 'records': {}}
-                            }
-                        
-                        # Create a unique key to count occurrences (source_address, destination_address, destination_port)
-                        key = (source_address, destination_address, destination_port)
-
-                        # Count per port
-                        if internal_or_external_source == 'internal':
-                            protocol_key = f'{protocol_name}_Internal'
-                        else:
-                            protocol_key = f'{protocol_name}_External'
-                        
-                        data_dict[vnicsubnetocid][protocol_key]['ports'].add(destination_port)
-                        data_dict[vnicsubnetocid][protocol_key]['port_counts'][destination_port] = \
-                            data_dict[vnicsubnetocid][protocol_key]['port_counts'].get(destination_port, 0) + 1
-
-                        # Count for (source, destination, port) combination
-                        data_dict[vnicsubnetocid][protocol_key]['records'][key] = \
-                            data_dict[vnicsubnetocid][protocol_key]['records'].get(key, 0) + 1
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON file {obj.name}: {e}")
-            continue
-
-# Create a new JSON file for each VNIC subnet OCID
-for vnicsubnetocid, data in data_dict.items():
+            subnet_table = json.load(object_storage_client.get_object(namespace, bucket_name, SUBNET_TABLE_NAME).data.raw)
+        except oci.exceptions.ServiceError as e:
+            if e.status != 404:
+                raise
+            subnet_table = {}
+            tables = oci.pagination.list_call_get_all_results(object_storage_client.list_objects, namespace, bucket_name, prefix=LEGACY_SUBNET_TABLE_PREFIX).data.objects
+            # Object names end in the run timestamp, so newer runs overwrite older entries
+            for table in sorted(tables, key=lambda table: table.name):
+                subnet_table.update(json.load(object_storage_client.get_object(namespace, bucket_name, table.name).data.raw))
+    return subnet_table.get(vnicsubnetocid, {})
+
+# List every parsed flow file in the bucket (.ndjson.gz, .parquet or older .json), across all pages
+def list_parsed_files():
+    objects = oci.pagination.list_call_get_all_results(
+        object_storage_client.list_objects, namespace, bucket_name, prefix='parsed_data_', fields='name,size'
+    ).data.objects
+    return [obj.name for obj in objects if flow_log_parser.is_parsed_output(obj.name)]
+
+# Map step: aggregate the ingress TCP/UDP records of one parsed file (runs in a worker process).
+# Exact counts go to a FlowCounter, or to a SketchAggregate when sketch settings are given.
+def aggregate_object(object_name, sketch_settings=None):
+    counter = flow_aggregator.FlowCounter(KEY_FIELDS) if sketch_settings is None else SketchAggregate(sketch_settings)
+    # Stream the records from Object Storage
+    try:
+        file_stream = object_storage_client.get_object(namespace, bucket_name, object_name).data.raw
+        for item in flow_log_parser.iter_parsed_records(file_stream, object_name):
+            # Filter data based on traffic direction
+            if item.get('traffic_direction') != 'ingress':
+                continue
+
+            # Check if protocolName is TCP or UDP
+            protocol_name = item['protocolName']
+            if protocol_name not in ['TCP', 'UDP']:
+                continue
+
+            # Get the VNIC subnet OCID (files written before the normalized format nest it under 'oracle')
+            vnicsubnetocid = item['vnicsubnetocid'] if 'vnicsubnetocid' in item else item['oracle']['vnicsubnetocid']
+
+            # Count per source type
+            if item['internal_or_external_source'] == 'internal':
+                protocol_key = f'{protocol_name}_Internal'
+            else:
+                protocol_key = f'{protocol_name}_External'
+
+            # Count for (source, destination, port) combination
+            counter.add((vnicsubnetocid, protocol_key, item['sourceAddress'], item.get('destinationAddress'), item['destinationPort']))
+    except (json.JSONDecodeError, EOFError, OSError) as e:
+        print(f"Error decoding parsed file {object_name}: {e}")
+    return counter
+
+# Reduce step: merge the partial results of every file, in listing order
+def aggregate_all(object_names, max_workers=READ_WORKERS, sketch_settings=None):
+    results = flow_aggregator.FlowCounter(KEY_FIELDS) if sketch_settings is None else SketchAggregate(sketch_settings)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(READ_MP_CONTEXT), initializer=init_clients) as executor:
+        for partial_result in executor.map(partial(aggregate_object, sketch_settings=sketch_settings), object_names):
+            results.merge(partial_result)
+    return results
+
+def _empty_subnet_data():
+    return {protocol: {'ports': set(), 'port_counts': {}, 'records': {}} for protocol in PROTOCOL_KEYS}
+
+# Regroup the merged counts into ports, port counts and tuple counts per subnet and protocol
+def group_by_subnet(results):
+    data_dict = {}
+    for (vnicsubnetocid, protocol_key, source_address, destination_address, destination_port), count, _, _, _ in results.items():
+        if vnicsubnetocid not in data_dict:
+            data_dict[vnicsubnetocid] = _empty_subnet_data()
+        data = data_dict[vnicsubnetocid][protocol_key]
+        data['ports'].add(destination_port)
+        data['port_counts'][destination_port] = data['port_counts'].get(destination_port, 0) + count
+        data['records'][(source_address, destination_address, destination_port)] = count
+    return data_dict
+
+# Same layout from the sketches: exact ports and port counts, the top tuples with estimated counts,
+# distinct source estimates per port and the overcount bound of the tuple estimates
+def group_sketches_by_subnet(results):
+    data_dict = {}
+    for (vnicsubnetocid, protocol_key), entry in results.subnets.items():
+        if vnicsubnetocid not in data_dict:
+            data_dict[vnicsubnetocid] = _empty_subnet_data()
+        data_dict[vnicsubnetocid][protocol_key] = {
+            'ports': set(entry['port_counts']),
+            'port_counts': entry['port_counts'],
+            'records': dict(entry['hitters'].items()),
+            'distinct_sources': {port: sources.count() for port, sources in entry['sources'].items()},
+            'count_error_bound': entry['hitters'].sketch.error_bound()
+        }
+    return data_dict
+
+# Generate port ranges, e.g. 80,443,8000-8010
+def port_ranges(ports):
+    ranges = []
+    for k, g in itertools.groupby(enumerate(sorted(ports)), key=lambda x: x[0] - x[1]):
+        group = list(map(lambda x: x[1], g))
+        if len(group) > 1:
+            ranges.append(f"{group[0]}-{group[-1]}")
+        else:
+            ranges.append(str(group[0]))
+    return ','.join(ranges)
+
+def build_subnet_output(vnicsubnetocid, data):
+    subnet_details = get_subnet_details(vnicsubnetocid)
     output_data = {
         "vnicsubnetocid": vnicsubnetocid,  # Add vnicsubnetocid at the top
+        "cidr_block": subnet_details.get("cidr_block"),
+        "security_list_ids": subnet_details.get("security_list_ids", []),
         "protocols": {}
     }
-    
-    for protocol in ['TCP_Internal', 'TCP_External', 'UDP_Internal', 'UDP_External']:
-        ports = sorted(data[protocol]['ports'])
-        ranges = []
-        
-        # Generate port ranges
-        for k, g in itertools.groupby(enumerate(ports), key=lambda x: x[0] - x[1]):
-            group = list(map(lambda x: x[1], g))
-            if len(group) > 1:
-                ranges.append(f"{group[0]}-{group[-1]}")
-            else:
-                ranges.append(str(group[0]))
-        
+
+    for protocol in PROTOCOL_KEYS:
         # Sort port_counts based on count value in descending order
         port_counts = sorted(
             [{"port": port, "count": count} for port, count in data[protocol]['port_counts'].items()],
-            key=lambda x: x['count'], 
+            key=lambda x: x['count'],
             reverse=True
         )
+        if 'distinct_sources' in data[protocol]:
+            for port_count in port_counts:
+                port_count['distinct_sources'] = data[protocol]['distinct_sources'].get(port_count['port'], 0)
 
         # Add port ranges and sorted port_counts to the output
         output_data['protocols'][protocol] = {
-            'port_ranges': ','.join(ranges),
+            'port_ranges': port_ranges(data[protocol]['ports']),
             'port_counts': port_counts,
             'detailed_records': []  # For the detailed section
         }
-        
+        if 'count_error_bound' in data[protocol]:
+            # detailed_records only holds the top talkers and their counts may be overestimated by this much
+            output_data['protocols'][protocol]['approximate'] = True
+            output_data['protocols'][protocol]['count_error_bound'] = data[protocol]['count_error_bound']
+
         # Process each record for this protocol (source_address, destination_address, destination_port, count)
         for (source_address, destination_address, destination_port), count in data[protocol]['records'].items():
             output_data['protocols'][protocol]['detailed_records'].append({
@@ -108,7 +232,38 @@ for vnicsubnetocid, data in data_dict.items():
                 'destination_port': destination_port,
                 'count': count
             })
-    
-    # Write the output dictionary to a JSON file in Object Storage
+    return output_data
+
+# Write the output dictionary to a JSON file in Object Storage
+def upload_subnet_output(vnicsubnetocid, output_data):
     filename = f"{vnicsubnetocid}.json"
-    object_storage_client.put_object(namespace, "final_results", filename, json.dumps(output_data).encode('utf-8'))
+    object_storage_client.put_object(namespace, results_bucket_name, filename, json.dumps(output_data).encode('utf-8'),
+                                     retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
+    return filename
+
+def main(read_workers, upload_workers, sketch_settings=None):
+    object_names = list_parsed_files()
+    print(f"Aggregating {len(object_names)} parsed files with {read_workers} workers")
+    results = aggregate_all(object_names, read_workers, sketch_settings)
+    data_dict = group_by_subnet(results) if sketch_settings is None else group_sketches_by_subnet(results)
+
+    # Create a new JSON file for each VNIC subnet OCID
+    outputs = [(vnicsubnetocid, build_subnet_output(vnicsubnetocid, data)) for vnicsubnetocid, data in data_dict.items()]
+    with ThreadPoolExecutor(max_workers=upload_workers) as executor:
+        for filename in executor.map(lambda output: upload_subnet_output(*output), outputs):
+            print(f"Uploaded {filename}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Derive least-privilege ingress ports per subnet from parsed flow logs")
+    parser.add_argument("--read-workers", type=int, default=READ_WORKERS, help="Processes reading and aggregating parsed files")
+    parser.add_argument("--upload-workers", type=int, default=UPLOAD_WORKERS, help="Threads uploading per-subnet results")
+    parser.add_argument("--approximate", action="store_true", help="Use fixed-size sketches instead of exact tuple counts")
+    parser.add_argument("--epsilon", type=float, default=sketches.EPSILON, help="Tuple counts are overestimated by at most epsilon * total")
+    parser.add_argument("--delta", type=float, default=sketches.DELTA, help="Probability that a tuple count exceeds the epsilon bound")
+    parser.add_argument("--top-k", type=int, default=sketches.TOP_K, help="Top talkers kept per subnet and protocol")
+    parser.add_argument("--hll-error", type=float, default=sketches.HLL_ERROR, help="Relative error of distinct source counts")
+    args = parser.parse_args()
+
+    sketch_settings = SketchSettings(args.epsilon, args.delta, args.top_k, args.hll_error) if args.approximate else None
+    init_clients()
+    main(args.read_workers, args.upload_workers, sketch_settings)
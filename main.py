@@ -1,13 +1,53 @@
 import oci
-import pandas as pd
 import datetime
-import ipaddress
+import os
+import argparse
+import collections
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import rule_engine
+import flow_log_index
+import flow_log_search
+import resource_cache
+import output_writer
+import threading
 
 # Initialize the config and clients
 config = oci.config.from_file()
 virtual_network_client = oci.core.VirtualNetworkClient(config)
 logging_client = oci.logging.LoggingManagementClient(config)
 identity_client = oci.identity.IdentityClient(config)
+log_search_client = oci.loggingsearch.LogSearchClient(config)
+network_cache = resource_cache.ResourceCache(virtual_network_client)
+
+# Compiled rules keyed by (security list OCID, etag), shared by every subnet using the list
+compiled_security_lists = {}
+compiled_security_lists_lock = threading.Lock()
+
+# Upper bound on concurrent OCI calls made while crawling and validating
+MAX_WORKERS = 8
+# Validations submitted ahead of the one being written, per worker; bounds the finished results held in memory
+VALIDATIONS_IN_FLIGHT_PER_WORKER = 2
+
+# Search once per batch of logs in a log group instead of once per (subnet, security list) pair
+BATCH_SEARCH = True
+LOGS_PER_SEARCH = 20
+
+# Output files are streamed here in OUTPUT_FORMAT; Excel export is an optional post-processing step
+OUTPUT_DIRECTORY = r"C:\Security\Blogs\Security_List\Logs"
+OUTPUT_FORMAT = 'csv.gz'
+SUBNET_COLUMNS = ["Compartment_ID", "VCN_ID", "VCN_Name", "Subnet_ID", "Subnet_Name", "Flow_Logs_Enabled",
+                  "Log_Group_ID", "Log_Group_Name", "Log_id", "Log_Name", "Security_List_ID"]
+MATCHED_COLUMNS = ["Compartment_ID", "Subnet_ID", "Security_List_ID", "Source_Address", "Destination_Address", "Protocol",
+                   "Flow Log Dest Port", "Security_List_Port_range", "reason", "Rule_Index", "Count", "First_Seen", "Last_Seen"]
+UNMATCHED_COLUMNS = ["Compartment_ID", "Subnet_ID", "Security_List_ID", "Source_Address", "Destination_Address", "Protocol",
+                     "Port", "mismatch_reason", "Rule_Index", "Count", "First_Seen", "Last_Seen"]
+RULE_COLUMNS = ["Security_List_ID", "Rule_Index", "Source", "Protocol", "TCP_Destination_Port_range",
+                "UDP_Destination_Port_range", "Description", "Rule"]
+COUNT_COLUMNS = ["Rule_Index", "Count"]
+
+# Below this many unique flow tuples the scalar matcher is faster than building NumPy arrays
+BATCH_EVALUATION_MIN_TUPLES = 256
 
 def list_all_compartments(tenancy_id):
     try:
@@ -44,264 +84,324 @@ def list_all_subnets(compartment_id, vcn_id):
         print(f"Failed to list subnets for VCN {vcn_id}: {e}")
         return []
 
-def check_flow_logs_enabled(compartment_id, subnet_id):
-    try:
-        log_groups = oci.pagination.list_call_get_all_results(
-            logging_client.list_log_groups,
-            compartment_id,
-            is_compartment_id_in_subtree=True
-        ).data
-        
-        for log_group in log_groups:
-            list_logs_response = logging_client.list_logs(
-                log_group_id=log_group.id,
-                log_type="SERVICE"
-            ).data
-            for log in list_logs_response:
-                if log.configuration.source.service in ['flowlogstest', 'flowlogs'] and log.configuration.source.resource == subnet_id:
-                    return True, log_group.id, log_group.display_name, log.id, log.display_name
-        return False, None, None, None, None
-    except Exception as e:
-        print(f"Failed to check flow logs for subnet {subnet_id}: {e}")
+# Constant-time lookup in the index built once per run by flow_log_index.build_flow_log_index
+def check_flow_logs_enabled(subnet_flow_logs, subnet_id):
+    log_info = subnet_flow_logs.get(subnet_id)
+    if log_info is None:
         return False, None, None, None, None
+    log_group_id, log_group_name, log_id, log_name = log_info
+    return True, log_group_id, log_group_name, log_id, log_name
 
-def query_flow_logs(query_id, limit=500):
-    logging_client = oci.loggingsearch.LogSearchClient(config)
-    end_time = datetime.datetime.utcnow()
-    start_time = end_time - datetime.timedelta(days=13)
-    search_query = f'search "{query_id}" | sort by datetime desc'
-    search_logs_response = logging_client.search_logs(
-        search_logs_details=oci.loggingsearch.models.SearchLogsDetails(
-            time_start=start_time,
-            time_end=end_time,
-            search_query=search_query
-        ),
-        limit=limit
-    ).data
-
-    # Initialize a list to hold the results
-    log_results = []
-
-    # Get the data from response and store in the list of dictionaries
-    for log in search_logs_response.results:
-        log_data = log.data['logContent']['data']
-        oracle_data = log.data['logContent']['oracle']       
-        
-        log_dict = {
-            "sourceAddress": log_data.get('sourceAddress'),
-            "sourcePort": log_data.get('sourcePort'),
-            "destinationAddress": log_data.get('destinationAddress'),
-            "destinationPort": log_data.get('destinationPort'),
-            "action": log_data.get('action'),
-            "protocolName": log_data.get('protocolName'),
-            "compartmentid": oracle_data.get('compartmentid'),
-            "resourceId": oracle_data.get('resourceId'),
-            "resourceType": oracle_data.get('resourceType'),
-            "vcnOcid": oracle_data.get('vcnOcid'),
-            "vnicocid": oracle_data.get('vnicocid'),
-            "vnicsubnetocid": oracle_data.get('vnicsubnetocid')
-        }
+# Stream the ACCEPT flow log records of a log. Action, protocol and destination filters and the
+# field projection are pushed into the Logging Search query; see flow_log_search.build_flow_log_query.
+def query_flow_logs(query_id, destination_cidrs=None, protocols=None, limit=flow_log_search.PAGE_LIMIT):
+    search_query = flow_log_search.build_flow_log_query([query_id], protocols=protocols, destination_cidrs=destination_cidrs)
+    for log in flow_log_search.iter_search_results(log_search_client, search_query, limit=limit):
+        yield flow_log_search.flow_log_to_dict(log)
 
-        # Append the log dictionary to the list
-        log_results.append(log_dict)
+# Compact verdict kept per validated flow tuple: indexes into the validation's deduplicated flow
+# table and into the security list's rule table. Output rows are only rendered when written.
+FlowVerdict = collections.namedtuple("FlowVerdict", ["flow_index", "rule_index", "kind"])
 
-    return log_results
+def format_port_range(port_range):
+    return f"{port_range.min}-{port_range.max}"
 
-def validate_security_list(data):
-    security_list_response = virtual_network_client.get_security_list(data["Security_List_ID"]).data
-    query_flow_logs_response = query_flow_logs(f'{data["Compartment_ID"]}/{data["Log_Group_ID"]}/{data["Log_id"]}')
-    subnet = virtual_network_client.get_subnet(data['Subnet_ID']).data
-
-    # Mapping for protocols
-    Protocol_mapping = {
-        "1": "ICMP",
-        "2": "IGMP",
-        "6": "TCP",
-        "17": "UDP",
-        "41": "IPv6",
-        "47": "GRE",
-        "50": "ESP",
-        "51": "AH",
-        "58": "ICMPv6",
-        "88": "EIGRP",
-        "89": "OSPF",
-        "132": "SCTP",
-        "112": "VRRP",
-        "115": "L2TP",
-        "118": "STP",
-        "121": "SMP",
-        "123": "NTP",
-        "137": "NETBIOS",
-        "138": "NETBIOS Datagram Service",
-        "139": "NETBIOS Session Service",
-        "142": "IRTP",
-        "161": "SNMP",
-        "162": "SNMP Trap",
-        "179": "BGP",
-        "199": "SMUX",
-        "204": "ATMP",
-        "224": "NCP",
-        "255": "Reserved"
+def render_verdict(validation, verdict):
+    data = validation["data"]
+    flow_tuple = validation["flows"][verdict.flow_index]
+    flow_log_record = flow_tuple["record"]
+    security_list_rule = validation["compiled_rules"].rule(verdict.rule_index)
+    record = {
+        "Compartment_ID": data["Compartment_ID"],
+        "Subnet_ID": data['Subnet_ID'],
+        "Security_List_ID": data["Security_List_ID"],
+        "Source_Address": flow_log_record["sourceAddress"],
+        "Destination_Address": flow_log_record["destinationAddress"],
+        "Protocol": flow_log_record["protocolName"],
+        "Rule_Index": verdict.rule_index,
+        "Count": flow_tuple["count"],
+        "First_Seen": flow_log_search.format_seen(flow_tuple["first_seen"]),
+        "Last_Seen": flow_log_search.format_seen(flow_tuple["last_seen"])
     }
+    if verdict.kind == rule_engine.PROTOCOL_MISMATCH:
+        record_protocol = (flow_log_record["protocolName"] or "").upper()
+        rule_protocol_number = str(security_list_rule.protocol)
+        record["Port"] = flow_log_record["destinationPort"]
+        record["mismatch_reason"] = f"Protocol mismatch: Flow Log Protocol {record_protocol} != Security Rule Protocol number {rule_protocol_number} and {rule_engine.PROTOCOL_MAPPING.get(rule_protocol_number, 'Unknown')}"
+        return record
 
-    sl_matched_records = []  # To store matched records
-    sl_unmatched_records = []  # To store unmatched records
+    record["Flow Log Dest Port"] = rule_engine.parse_port(flow_log_record["destinationPort"])
+    if verdict.kind == rule_engine.MATCH_ALL:
+        record["Security_List_Port_range"] = 'ALL'
+        record["reason"] = "All Ports"
+    elif verdict.kind == rule_engine.MATCH_TCP:
+        record["Security_List_Port_range"] = format_port_range(security_list_rule.tcp_options.destination_port_range)
+        record["reason"] = "TCP port match"
+    elif verdict.kind == rule_engine.MATCH_UDP:
+        record["Security_List_Port_range"] = format_port_range(security_list_rule.udp_options.destination_port_range)
+        record["reason"] = "UDP port match"
+    else:
+        record["Security_List_Port_range"] = 'NA'
+        record["reason"] = "Other port match"
+    return record
 
-    for flow_log_record in query_flow_logs_response:
-        try:
-            ip_address = ipaddress.ip_address(flow_log_record["destinationAddress"])
-            source_ip_address = ipaddress.ip_address(flow_log_record["sourceAddress"])
-        except ValueError:
+# Rows of the per-run rule table that the Rule_Index column of matched/unmatched rows refers to
+def render_security_list_rules(security_list_id, compiled_rules):
+    for index, rule in enumerate(compiled_rules.rules):
+        yield {
+            "Security_List_ID": security_list_id,
+            "Rule_Index": index,
+            "Source": rule.source,
+            "Protocol": rule.protocol,
+            "TCP_Destination_Port_range": format_port_range(rule.tcp_options.destination_port_range) if rule.tcp_options and rule.tcp_options.destination_port_range else None,
+            "UDP_Destination_Port_range": format_port_range(rule.udp_options.destination_port_range) if rule.udp_options and rule.udp_options.destination_port_range else None,
+            "Description": rule.description,
+            "Rule": str(rule)
+        }
+
+# Fetch and compile everything needed to validate one (subnet, security list) row
+def prepare_validation(data):
+    security_list_response, etag = network_cache.get_with_etag(data["Security_List_ID"], "SecurityList", virtual_network_client.get_security_list)
+    subnet = network_cache.get_subnet(data['Subnet_ID'])
+
+    # Compile the rules once per security list version and the subnet CIDR once per row,
+    # instead of re-parsing them for every flow record
+    with compiled_security_lists_lock:
+        compiled_rules = compiled_security_lists.get((data["Security_List_ID"], etag))
+        if compiled_rules is None:
+            compiled_rules = rule_engine.CompiledSecurityList(security_list_response.ingress_security_rules)
+            compiled_security_lists[(data["Security_List_ID"], etag)] = compiled_rules
+    return {
+        "data": data,
+        "subnet_cidr": subnet.cidr_block,
+        "subnet_range": rule_engine.compile_cidr(subnet.cidr_block),
+        "compiled_rules": compiled_rules,
+        "flows": [],  # Deduplicated flow table the verdicts refer to
+        "matched": [],  # FlowVerdicts of matched flows
+        "unmatched": [],  # FlowVerdicts of unmatched flows
+        "skipped": 0  # Records the query predicate let through but that fall outside the subnet
+    }
+
+# Validate the unique flow tuples of one subnet (see flow_log_search.aggregate_flow_record). Each
+# verdict is computed once and refers to its tuple by index into flow_table. Large blocks are
+# evaluated with rule_engine.match_batch when NumPy is installed; the verdicts are the same.
+def validate_flow_tuples(validation, flow_table):
+    validation["flows"] = flow_table
+    candidates = []
+    sources = []
+    protocols = []
+    ports = []
+    for flow_index, flow_tuple in enumerate(flow_table):
+        flow_log_record = flow_tuple["record"]
+        destination_address = rule_engine.parse_address(flow_log_record["destinationAddress"])
+        source_address = rule_engine.parse_address(flow_log_record["sourceAddress"])
+        if destination_address is None or source_address is None:
+            continue
+
+        # The query predicate can select a superset of the subnet CIDR, so keep the exact check
+        if not (rule_engine.address_in_range(destination_address, validation["subnet_range"]) and flow_log_record["action"] == 'ACCEPT'):
+            validation["skipped"] += flow_tuple["count"]
             continue
 
-        network = ipaddress.ip_network(subnet.cidr_block, strict=False)
-
-        if ip_address in network and flow_log_record["action"] == 'ACCEPT':
-            validate_sec_list=False            
-            for security_list_rule in security_list_response.ingress_security_rules:
-                if not validate_sec_list:
-                    try:
-                        rule_network = ipaddress.ip_network(security_list_rule.source, strict=False)
-                    except ValueError:
-                        continue  # Skip if source cannot be converted to network
-
-                    if source_ip_address not in rule_network:
-                        continue  # Skip if source IP is not in the CIDR block
-
-                    # Check if the protocol name (from log) matches the protocol number (from rule)
-                    record_protocol = flow_log_record["protocolName"].upper()  # Log's protocol (like 'TCP')
-                    rule_protocol_number = str(security_list_rule.protocol)  # Security rule protocol number
-
-                    if security_list_rule.protocol.upper() == 'ALL':
-                        destination_port = int(flow_log_record["destinationPort"])
-                        sl_matched_records.append({
-                            "Compartment_ID": data["Compartment_ID"],
-                            "Subnet_ID": data['Subnet_ID'],
-                            "Security_List_ID": data["Security_List_ID"],
-                            "Flow Log Dest Port": destination_port,
-                            "Security_List_Port_range": 'ALL',
-                            "reason": "All Ports",
-                            "misc":""
-                        })
-                        validate_sec_list=True            
-                    elif(rule_protocol_number in Protocol_mapping and Protocol_mapping[rule_protocol_number] == record_protocol):
-
-                        # Check TCP Options
-                        if record_protocol == "TCP" and security_list_rule.tcp_options:
-                            destination_port = int(flow_log_record["destinationPort"])
-                            if security_list_rule.tcp_options.destination_port_range:
-                                port_range = security_list_rule.tcp_options.destination_port_range
-                                if port_range.min <= destination_port <= port_range.max:
-                                    sl_matched_records.append({
-                                        "Compartment_ID": data["Compartment_ID"],
-                                        "Subnet_ID": data['Subnet_ID'],
-                                        "Security_List_ID": data["Security_List_ID"],
-                                        "Flow Log Dest Port": destination_port,
-                                        "Security_List_Port_range": port_range,
-                                        "reason": "TCP port match",
-                                        "misc":f"Flow Log Record is {str(flow_log_record)} and Security List is {str(security_list_rule)})"
-                                    })
-                                    validate_sec_list=True 
-                        elif record_protocol == "UDP" and security_list_rule.udp_options:
-                            destination_port = int(flow_log_record["destinationPort"])
-                            if security_list_rule.udp_options.destination_port_range:
-                                port_range = security_list_rule.udp_options.destination_port_range
-                                if port_range.min <= destination_port <= port_range.max:
-                                    sl_matched_records.append({
-                                        "Compartment_ID": data["Compartment_ID"],
-                                        "Subnet_ID": data['Subnet_ID'],
-                                        "Security_List_ID": data["Security_List_ID"],
-                                        "Flow Log Dest Port": destination_port,
-                                        "Security_List_Port_range": port_range,
-                                        "reason": "UDP port match",
-                                        "misc":f"Flow Log Record is {str(flow_log_record)} and Security List is {str(security_list_rule)})"
-                                    })
-                                    validate_sec_list=True 
-                        else:
-                            destination_port = int(flow_log_record["destinationPort"])
-                            sl_matched_records.append({
-                                        "Compartment_ID": data["Compartment_ID"],
-                                        "Subnet_ID": data['Subnet_ID'],
-                                        "Security_List_ID": data["Security_List_ID"],
-                                        "Port": destination_port,
-                                        "Port_range": 'NA',
-                                        "reason": "Other port match",
-                                        "misc":f"Flow Log Record is {str(flow_log_record)} and Security List is {str(security_list_rule)})"
-                                    })
-                            validate_sec_list=True 
-                    else:
-                        sl_unmatched_records.append({
-                            "Compartment_ID": data["Compartment_ID"],
-                            "Subnet_ID": data['Subnet_ID'],
-                            "Security_List_ID": data["Security_List_ID"],
-                            "Port": flow_log_record["destinationPort"],
-                            "Port_range": 'NA',
-                            "mismatch_reason": f"Protocol mismatch: Flow Log Protocol {record_protocol} != Security Rule Protocol number {rule_protocol_number} and {Protocol_mapping.get(rule_protocol_number, 'Unknown')}",
-                            "misc":f"Flow Log Record is {str(flow_log_record)} and Security List is {str(security_list_rule)})"
-                        })
-                        validate_sec_list=True 
+        candidates.append(flow_index)
+        sources.append(source_address)
+        protocols.append((flow_log_record["protocolName"] or "").upper())  # Log's protocol (like 'TCP')
+        ports.append(rule_engine.parse_port(flow_log_record["destinationPort"]))
+
+    compiled_rules = validation["compiled_rules"]
+    if rule_engine.np is not None and len(candidates) >= BATCH_EVALUATION_MIN_TUPLES:
+        verdicts = rule_engine.match_batch(compiled_rules, sources, protocols, ports)
+    else:
+        verdicts = [compiled_rules.match(source, protocol, port) for source, protocol, port in zip(sources, protocols, ports)]
+
+    for flow_index, verdict in zip(candidates, verdicts):
+        if verdict is None:
+            continue
+        kind, rule_index = verdict
+        if kind == rule_engine.PROTOCOL_MISMATCH:
+            validation["unmatched"].append(FlowVerdict(flow_index, rule_index, kind))
         else:
-            print(f"{ip_address} is not part of CIDR {network}")
+            validation["matched"].append(FlowVerdict(flow_index, rule_index, kind))
+
+def finish_validation(validation):
+    if validation["skipped"]:
+        print(f"Skipped {validation['skipped']} records outside CIDR {validation['subnet_cidr']} for security list {validation['data']['Security_List_ID']}")
+    return validation
+
+def validate_security_list(data):
+    validation = prepare_validation(data)
+    # Protocols are not filtered server-side: a rule with another protocol still yields an unmatched record
+    query_flow_logs_response = query_flow_logs(f'{data["Compartment_ID"]}/{data["Log_Group_ID"]}/{data["Log_id"]}', destination_cidrs=[validation["subnet_cidr"]])
+    flow_tuples = {}
+    for flow_log_record in query_flow_logs_response:
+        flow_log_search.aggregate_flow_record(flow_tuples, flow_log_record)
+    validate_flow_tuples(validation, list(flow_tuples.values()))
+    return finish_validation(validation)
+
+# Validate every row of one batch with a single search over all of their logs. Records are
+# demultiplexed by vnicsubnetocid, aggregated per subnet and fanned out to every security list of that subnet.
+def validate_log_batch(rows):
+    validations = [prepare_validation(row) for row in rows]
+    subnet_validations = {}
+    scopes = []
+    destination_cidrs = []
+    for validation in validations:
+        data = validation["data"]
+        if data['Subnet_ID'] not in subnet_validations:
+            scopes.append(f'{data["Compartment_ID"]}/{data["Log_Group_ID"]}/{data["Log_id"]}')
+            destination_cidrs.append(validation["subnet_cidr"])
+        subnet_validations.setdefault(data['Subnet_ID'], []).append(validation)
+
+    subnet_flow_tuples = {subnet_id: {} for subnet_id in subnet_validations}
+    search_query = flow_log_search.build_flow_log_query(scopes, destination_cidrs=destination_cidrs)
+    for log in flow_log_search.iter_search_results(log_search_client, search_query):
+        flow_log_record = flow_log_search.flow_log_to_dict(log)
+        flow_tuples = subnet_flow_tuples.get(flow_log_record["vnicsubnetocid"])
+        if flow_tuples is not None:
+            flow_log_search.aggregate_flow_record(flow_tuples, flow_log_record)
+
+    for subnet_id, flow_tuples in subnet_flow_tuples.items():
+        flow_table = list(flow_tuples.values())  # Shared by every security list of the subnet
+        for validation in subnet_validations[subnet_id]:
+            validate_flow_tuples(validation, flow_table)
 
-    return sl_matched_records, sl_unmatched_records
+    return [finish_validation(validation) for validation in validations]
 
+# Group the rows by log group and split each group into batches of at most LOGS_PER_SEARCH logs
+def log_batches(rows, logs_per_search=LOGS_PER_SEARCH):
+    rows_by_log_group = {}
+    for row in rows:
+        rows_by_log_group.setdefault(row["Log_Group_ID"], {}).setdefault(row["Log_id"], []).append(row)
 
-def main(tenancy_id):
-    # Prepare lists to store data
-    data = []
-    matched_records = []  # Initialize globally
-    unmatched_records = []  # Initialize globally
+    batches = []
+    for rows_by_log in rows_by_log_group.values():
+        log_rows = list(rows_by_log.values())
+        for start in range(0, len(log_rows), logs_per_search):
+            batches.append([row for rows_of_log in log_rows[start:start + logs_per_search] for row in rows_of_log])
+    return batches
 
+# Like executor.map, but with at most `window` calls in flight: the next item is submitted as each
+# result is taken, so finished results cannot pile up behind a slow one. Results keep input order.
+def bounded_map(executor, fn, items, window):
+    items = iter(items)
+    pending = collections.deque()
+
+    def submit_next():
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            return
+
+    try:
+        for _ in range(window):
+            submit_next()
+        while pending:
+            future = pending.popleft()
+            submit_next()
+            yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+# Walk compartments -> VCNs -> subnets with a bounded worker pool. executor.map returns results
+# in submission order, so the (compartment, VCN, subnet) list matches the serial walk.
+def crawl_subnets(tenancy_id, max_workers=MAX_WORKERS):
     compartments = list_all_compartments(tenancy_id)
-    for compartment in compartments:
-        print(f"Checking compartment_id:{compartment.id}")
-        compartment_id = compartment.id
-        vcns = list_all_vcns(compartment_id)
-        for vcn in vcns:
-            print(f"Checking VCN:{vcn.id}")
-            subnets = list_all_subnets(compartment_id, vcn.id)
-            for subnet in subnets:
-                print(f"checking subnet:{subnet.id}")
-                flow_logs_enabled, log_group_id, log_group_name, log_id, log_name = check_flow_logs_enabled(compartment_id, subnet.id)
-                security_lists = subnet.security_list_ids
-                # Flow Logs available, so go over each security list and make note of SL that allowed the traffic and port.
-                for security_list in security_lists:
-                    print(f"checking security list:{security_list}")      
-                    val = [{
-                        "Compartment_ID": compartment_id,
-                        "VCN_ID": vcn.id,
-                        "VCN_Name": vcn.display_name,
-                        "Subnet_ID": subnet.id,
-                        "Subnet_Name": subnet.display_name,
-                        "Flow_Logs_Enabled": flow_logs_enabled,
-                        "Log_Group_ID": log_group_id,
-                        "Log_Group_Name": log_group_name,
-                        "Log_id": log_id,
-                        "Log_Name": log_name,
-                        "Security_List_ID": security_list
-                    }]
-                    
-                    if flow_logs_enabled:
-                        new_matched, new_unmatched = validate_security_list(val[0])
-                        matched_records.extend(new_matched)  # Accumulate matched records
-                        unmatched_records.extend(new_unmatched)  # Accumulate unmatched records
-
-                    data.append(val[0])  # Fix the append issue for data
-
-    # Convert data to DataFrame and save to Excel
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        compartment_vcns = list(executor.map(lambda compartment: list_all_vcns(compartment.id), compartments))
+        vcns = []
+        for compartment, compartment_vcn_list in zip(compartments, compartment_vcns):
+            print(f"Checking compartment_id:{compartment.id}")
+            vcns.extend((compartment.id, vcn) for vcn in compartment_vcn_list)
+
+        vcn_subnets = list(executor.map(lambda item: list_all_subnets(item[0], item[1].id), vcns))
+
+    subnets = []
+    for (compartment_id, vcn), subnet_list in zip(vcns, vcn_subnets):
+        print(f"Checking VCN:{vcn.id}")
+        for subnet in subnet_list:
+            network_cache.observe(subnet, "Subnet")  # Later get_subnet calls are served from the cache
+            subnets.append((compartment_id, vcn, subnet))
+    return subnets
+
+def main(tenancy_id, max_workers=MAX_WORKERS, batch_search=BATCH_SEARCH, output_format=OUTPUT_FORMAT, export_excel=False,
+         refresh_cache=False):
+    # Rows are streamed to the output files while the crawl runs instead of being held until the end
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    # Rules are validated against the current security lists: every cached entry is revalidated
+    # (two list calls per VCN), whatever its age
+    if refresh_cache:
+        network_cache.clear()
+    vcn_count, refreshed = network_cache.revalidate(older_than=0)
+    print(f"Revalidated {refreshed} cached subnets and security lists in {vcn_count} VCNs")
+    # The writers are closed even if the crawl or validation fails, so partial output stays readable
+    with contextlib.ExitStack() as stack:
+        subnet_writer = stack.enter_context(output_writer.StreamingRowWriter(os.path.join(OUTPUT_DIRECTORY, f"raw_subnet_info_{timestamp}"), SUBNET_COLUMNS, output_format))
+        matched_writer = stack.enter_context(output_writer.StreamingRowWriter(os.path.join(OUTPUT_DIRECTORY, f"raw_data_matched_records_{timestamp}"), MATCHED_COLUMNS, output_format, integer_columns=COUNT_COLUMNS))
+        unmatched_writer = stack.enter_context(output_writer.StreamingRowWriter(os.path.join(OUTPUT_DIRECTORY, f"raw_data_unmatched_records_{timestamp}"), UNMATCHED_COLUMNS, output_format, integer_columns=COUNT_COLUMNS))
+        rules_writer = stack.enter_context(output_writer.StreamingRowWriter(os.path.join(OUTPUT_DIRECTORY, f"security_list_rules_{timestamp}"), RULE_COLUMNS, output_format, integer_columns=["Rule_Index"]))
 
-    df = pd.DataFrame(data)
-    df.to_excel(rf"C:\Security\Blogs\Security_List\Logs\raw_subnet_info_{timestamp}.xlsx", index=False)
+        rows = []  # (subnet, security list) rows with flow logs, still needed for validation
+        subnet_flow_logs = flow_log_index.build_flow_log_index(logging_client, tenancy_id)
+        for compartment_id, vcn, subnet in crawl_subnets(tenancy_id, max_workers):
+            print(f"checking subnet:{subnet.id}")
+            flow_logs_enabled, log_group_id, log_group_name, log_id, log_name = check_flow_logs_enabled(subnet_flow_logs, subnet.id)
+            security_lists = subnet.security_list_ids
+            # Flow Logs available, so go over each security list and make note of SL that allowed the traffic and port.
+            for security_list in security_lists:
+                print(f"checking security list:{security_list}")
+                row = {
+                    "Compartment_ID": compartment_id,
+                    "VCN_ID": vcn.id,
+                    "VCN_Name": vcn.display_name,
+                    "Subnet_ID": subnet.id,
+                    "Subnet_Name": subnet.display_name,
+                    "Flow_Logs_Enabled": flow_logs_enabled,
+                    "Log_Group_ID": log_group_id,
+                    "Log_Group_Name": log_group_name,
+                    "Log_id": log_id,
+                    "Log_Name": log_name,
+                    "Security_List_ID": security_list
+                }
+                subnet_writer.write(row)
+                if flow_logs_enabled:
+                    rows.append(row)
 
-    # Save matched records to Excel
-    df_matched = pd.DataFrame(matched_records)
-    df_matched.to_excel(rf"C:\Security\Blogs\Security_List\Logs\raw_data_matched_records_{timestamp}.xlsx", index=False)
+        # Validate the security lists concurrently. bounded_map yields in submission order, so results
+        # are written in a deterministic order (crawl order, or log batch order in batched mode).
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            window = VALIDATIONS_IN_FLIGHT_PER_WORKER * max_workers
+            if batch_search:
+                validations = (result for batch_results in bounded_map(executor, validate_log_batch, log_batches(rows), window) for result in batch_results)
+            else:
+                validations = bounded_map(executor, validate_security_list, rows, window)
+            written_rule_tables = set()
+            for validation in validations:
+                compiled_rules = validation["compiled_rules"]
+                if id(compiled_rules) not in written_rule_tables:
+                    written_rule_tables.add(id(compiled_rules))
+                    rules_writer.write_rows(render_security_list_rules(validation["data"]["Security_List_ID"], compiled_rules))
+                matched_writer.write_rows(render_verdict(validation, verdict) for verdict in validation["matched"])
+                unmatched_writer.write_rows(render_verdict(validation, verdict) for verdict in validation["unmatched"])
 
-    # Save unmatched records to Excel
-    df_unmatched = pd.DataFrame(unmatched_records)
-    df_unmatched.to_excel(rf"C:\Security\Blogs\Security_List\Logs\raw_data_unmatched_records_{timestamp}.xlsx", index=False)
+    output_paths = [writer.path for writer in (subnet_writer, matched_writer, unmatched_writer, rules_writer)]
+    for path in output_paths:
+        print(f"Results written to {path}")
+        if export_excel:
+            print(f"Exported to {output_writer.export_to_excel(path)}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate security lists against VCN flow logs")
+    parser.add_argument("--max-workers", type=int, default=MAX_WORKERS, help="Maximum number of concurrent OCI calls")
+    parser.add_argument("--search-per-security-list", action="store_true", help="Run one log search per (subnet, security list) pair")
+    parser.add_argument("--output-format", choices=output_writer.OUTPUT_FORMATS, default=OUTPUT_FORMAT, help="Format of the streamed output files")
+    parser.add_argument("--excel", action="store_true", help="Also export the output files to Excel after the run")
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help="Empty the subnet and security list cache first. Without it, cached entries are revalidated per VCN at "
+                             "the start of the run; entries in a VCN that cannot be listed are served for up to "
+                             f"{resource_cache.CACHE_TTL_SECONDS // 86400} days")
+    args = parser.parse_args()
+
     tenancy_id = config['tenancy']  # Get the tenancy ID from the config
-    main(tenancy_id)
+    main(tenancy_id, args.max_workers, batch_search=not args.search_per_security_list,
+         output_format=args.output_format, export_excel=args.excel, refresh_cache=args.refresh_cache)
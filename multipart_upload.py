@@ -0,0 +1,83 @@
+import oci
+
+# Bytes buffered before a part is uploaded; outputs smaller than one part are sent with a single put_object
+PART_SIZE = 16 * 1024 * 1024
+
+
+class MultipartUploadStream:
+    # Write-only file object that streams into an Object Storage object. Data is buffered until a
+    # full part is available and then sent with upload_part, so memory holds at most one part and
+    # nothing is staged on disk. close() commits the upload (or puts the object in one request when
+    # it never grew past one part); abort() discards whatever was uploaded.
+    def __init__(self, client, namespace, bucket_name, object_name, part_size=PART_SIZE):
+        self.client = client
+        self.namespace = namespace
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.bytes_written = 0
+        self.closed = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_part(self, body):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(
+                self.namespace,
+                self.bucket_name,
+                oci.object_storage.models.CreateMultipartUploadDetails(object=self.object_name),
+                retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY
+            ).data.upload_id
+        part_num = len(self.parts) + 1
+        response = self.client.upload_part(
+            self.namespace, self.bucket_name, self.object_name, self.upload_id, part_num, body,
+            retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY
+        )
+        self.parts.append(oci.object_storage.models.CommitMultipartUploadPartDetails(part_num=part_num, etag=response.headers['etag']))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.upload_id is None:
+            self.client.put_object(self.namespace, self.bucket_name, self.object_name, bytes(self.buffer),
+                                   retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
+        else:
+            if self.buffer:
+                self._upload_part(bytes(self.buffer))
+            self.client.commit_multipart_upload(
+                self.namespace, self.bucket_name, self.object_name, self.upload_id,
+                oci.object_storage.models.CommitMultipartUploadDetails(parts_to_commit=self.parts),
+                retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY
+            )
+        self.buffer = bytearray()
+
+    def abort(self):
+        self.closed = True
+        self.buffer = bytearray()
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(self.namespace, self.bucket_name, self.object_name, self.upload_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,137 @@
+import csv
+import gzip
+import json
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional
+    pa = None
+    pq = None
+
+OUTPUT_FORMATS = ('csv.gz', 'ndjson.gz', 'parquet')
+# Rows buffered before they are handed to the compressor / written as a Parquet row group
+BATCH_SIZE = 10000
+# Excel allows 1,048,576 rows per sheet, one of which is the header
+EXCEL_MAX_ROWS = 1048575
+
+
+# Values that are not plain scalars (e.g. OCI PortRange models) are written as their string form
+def _plain(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+class StreamingRowWriter:
+    # Append rows to <path_prefix>.<output_format> in batches while the crawl runs, so memory only
+    # holds one batch. Every row is written with the given columns; missing values are empty.
+    def __init__(self, path_prefix, columns, output_format='csv.gz', integer_columns=(), batch_size=BATCH_SIZE):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format {output_format}, expected one of {OUTPUT_FORMATS}")
+        if output_format == 'parquet' and pa is None:
+            raise ValueError("Parquet output requires pyarrow")
+        self.path = f"{path_prefix}.{output_format}"
+        self.columns = list(columns)
+        self.output_format = output_format
+        self.batch_size = batch_size
+        self.rows = []
+        self.row_count = 0
+
+        if output_format == 'csv.gz':
+            self.file = gzip.open(self.path, 'wt', newline='', encoding='utf-8')
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=self.columns, extrasaction='ignore')
+            self.csv_writer.writeheader()
+        elif output_format == 'ndjson.gz':
+            self.file = gzip.open(self.path, 'wt', encoding='utf-8')
+        else:
+            self.schema = pa.schema([(column, pa.int64() if column in integer_columns else pa.string()) for column in self.columns])
+            self.integer_columns = set(integer_columns)
+            self.parquet_writer = pq.ParquetWriter(self.path, self.schema, compression='zstd')
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.output_format == 'csv.gz':
+            self.csv_writer.writerows({column: _plain(row.get(column)) for column in self.columns} for row in self.rows)
+        elif self.output_format == 'ndjson.gz':
+            for row in self.rows:
+                self.file.write(json.dumps({column: _plain(row.get(column)) for column in self.columns}) + "\n")
+        else:
+            arrays = {}
+            for column in self.columns:
+                values = [_plain(row.get(column)) for row in self.rows]
+                if column not in self.integer_columns:
+                    values = [None if value is None else str(value) for value in values]
+                arrays[column] = values
+            self.parquet_writer.write_table(pa.Table.from_pydict(arrays, schema=self.schema))
+        self.row_count += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.output_format == 'parquet':
+            self.parquet_writer.close()
+        else:
+            self.file.close()
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Read a file produced by StreamingRowWriter back in chunks of pandas DataFrames
+def iter_dataframes(path, chunk_size=BATCH_SIZE):
+    import pandas as pd
+
+    if path.endswith('.csv.gz'):
+        yield from pd.read_csv(path, chunksize=chunk_size)
+    elif path.endswith('.ndjson.gz'):
+        yield from pd.read_json(path, lines=True, chunksize=chunk_size, compression='gzip')
+    elif path.endswith('.parquet'):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unsupported output file {path}")
+
+
+# Optional post-processing: copy a columnar output file into an Excel workbook. Rows beyond
+# Excel's sheet limit continue on additional sheets instead of being lost.
+def export_to_excel(path, excel_path=None, sheet_rows=EXCEL_MAX_ROWS):
+    import pandas as pd
+
+    if excel_path is None:
+        excel_path = os.path.splitext(path[:-3] if path.endswith('.gz') else path)[0] + '.xlsx'
+
+    with pd.ExcelWriter(excel_path) as excel_writer:
+        sheet_number = 1
+        sheet_row = 0
+        wrote_any = False
+        for chunk in iter_dataframes(path):
+            while not chunk.empty:
+                if sheet_row >= sheet_rows:
+                    sheet_number += 1
+                    sheet_row = 0
+                part = chunk.iloc[:sheet_rows - sheet_row]
+                chunk = chunk.iloc[len(part):]
+                sheet_name = f"Sheet{sheet_number}"
+                part.to_excel(excel_writer, sheet_name=sheet_name, index=False, header=sheet_row == 0,
+                              startrow=0 if sheet_row == 0 else sheet_row + 1)
+                sheet_row += len(part)
+                wrote_any = True
+        if not wrote_any:
+            pd.DataFrame().to_excel(excel_writer, sheet_name="Sheet1", index=False)
+    return excel_path
@@ -1,82 +1,127 @@
 import json
 import os
-from collections import defaultdict
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+import flow_log_parser
+import flow_aggregator
 
 # Define the folder containing your log files
 folder_path = r'C:\Security\Blogs\Security_List\Logs\downloads'
+output_file = r'C:\Security\Blogs\Security_List\Logs\downloads\response_data.xlsx'
 
-# Dictionary to store the results
-results = defaultdict(lambda: {'Count': 0, 'Traffic Direction': None, 'Security List OCID': None, 'Oracle Fields': {}})
-
-# Loop through each file in the folder
-for filename in os.listdir(folder_path):
-    if filename.endswith('.json'):  # Assuming your log files are in JSON format
-        file_path = os.path.join(folder_path, filename)
-
-        try:
-            # Check if the file is empty before opening
-            if os.path.getsize(file_path) == 0:
-                print(f"Skipping empty file: {filename}")
-                continue
-
-            with open(file_path, 'r') as f:
-                try:
-                    data = json.load(f)
-                except json.JSONDecodeError:
-                    print(f"Skipping malformed JSON file: {filename}")
-                    continue
-
-                for record in data:
+# Files are aggregated in parallel and their partial counts merged
+QUERY_WORKERS = os.cpu_count() or 2
+
+# Occurrences are counted per (source, destination, destination port)
+KEY_FIELDS = ['sourceAddress', 'destinationAddress', 'destinationPort']
+# Fields kept from the most recently seen record of each key, instead of whole records
+SAMPLE_FIELDS = ['traffic_direction', 'security_list_ocids', 'protocol', 'protocolName', 'internal_or_external_source',
+                 'internal_or_external_destination', 'traffic_type', 'vnicsubnetocid', 'vnicocid']
+
+# Security list details are kept in one table (security_lists.json) that every parsing run merges
+# into, and flow records only carry the OCIDs, so the table is loaded the first time a name is needed
+SECURITY_LIST_TABLE_NAME = 'security_lists.json'
+security_list_table = None
+
+def security_list_names(security_list_ocids):
+    global security_list_table
+    if security_list_table is None:
+        security_list_table = {}
+        table_path = os.path.join(folder_path, SECURITY_LIST_TABLE_NAME)
+        if os.path.exists(table_path):
+            with open(table_path, 'r') as f:
+                security_list_table = json.load(f)
+        else:
+            # Downloads from before the tables were merged hold per-run tables (security_lists_<run_id>.json);
+            # file names end in the run timestamp, so newer runs overwrite older entries
+            for filename in sorted(os.listdir(folder_path)):
+                if filename.startswith('security_lists_') and filename.endswith('.json'):
+                    with open(os.path.join(folder_path, filename), 'r') as f:
+                        security_list_table.update(json.load(f))
+    return ', '.join(security_list_table[ocid]['display_name'] for ocid in security_list_ocids if ocid in security_list_table)
+
+# Files written before the normalized format nest the subnet, VNIC and ingest time under 'oracle'
+def record_value(record, field):
+    if field in record:
+        return record[field]
+    return record.get('oracle', {}).get(field)
+
+# Aggregate the TCP records of one parsed file into a partial counter (runs in a worker process)
+def aggregate_file(file_path):
+    filename = os.path.basename(file_path)
+    counter = flow_aggregator.FlowCounter(KEY_FIELDS)
+    try:
+        # Check if the file is empty before opening
+        if os.path.getsize(file_path) == 0:
+            print(f"Skipping empty file: {filename}")
+            return counter
+
+        with open(file_path, 'rb') as f:
+            try:
+                # Records are read incrementally, whatever the file format
+                for record in flow_log_parser.iter_parsed_records(f, filename):
                     # Filter by protocolName 'TCP'
                     if record.get('protocolName') == 'TCP':
-                        # Extract relevant fields
-                        source_address = record.get('sourceAddress')
-                        destination_address = record.get('destinationAddress')
-                        destination_port = record.get('destinationPort')
-                        traffic_direction = record.get('traffic_direction')
-                        security_list_ocid = record.get('security_list_ocid')
-
-                        # Create a unique key for each occurrence
-                        key = (source_address, destination_address, destination_port)
-
-                        # Update the results dictionary
-                        results[key]['Count'] += 1
-                        results[key]['Traffic Direction'] = traffic_direction
-                        results[key]['Security List OCID'] = security_list_ocid
-
-                        # Store all other Oracle-specific fields
-                        oracle_fields = {k: v for k, v in record.items() if k not in ['sourceAddress', 'destinationAddress', 'destinationPort', 'traffic_direction', 'security_list_ocid']}
-                        results[key]['Oracle Fields'] = oracle_fields
-
-        except OSError as e:
-            print(f"Error reading file {filename}: {e}")
-
-# Convert the results to a list of dictionaries for DataFrame
-output_data = []
-for k, v in results.items():
-    # Flatten the Oracle fields for better readability in Excel
-    oracle_fields_flattened = {f"Oracle {key}": value for key, value in v['Oracle Fields'].items()}
-
-    # Prepare the row data including source, destination, port, and additional fields
-    row_data = {
-        'Source Address': k[0],
-        'Destination Address': k[1],
-        'Destination Port': k[2],
-        'Count': v['Count'],
-        'Traffic Direction': v['Traffic Direction'],
-        'Security List OCID': v['Security List OCID']
-    }
-
-    # Combine row data with flattened Oracle fields
-    row_data.update(oracle_fields_flattened)
-    output_data.append(row_data)
-
-# Create a DataFrame from the list of dictionaries
-df = pd.DataFrame(output_data)
-
-# Write the DataFrame to an Excel file
-output_file = r'C:\Security\Blogs\Security_List\Logs\downloads\response_data.xlsx'
-df.to_excel(output_file, index=False)
-
-print(f"Results written to {output_file}")
+                        counter.add(
+                            [record.get(field) for field in KEY_FIELDS],
+                            seen=record_value(record, 'ingestedtime'),
+                            sample=[record_value(record, field) for field in SAMPLE_FIELDS]
+                        )
+            except (json.JSONDecodeError, EOFError, OSError) as e:
+                print(f"Stopped reading malformed file {filename}: {e}")
+
+    except OSError as e:
+        print(f"Error reading file {filename}: {e}")
+    return counter
+
+def aggregate_folder(folder_path, max_workers=QUERY_WORKERS):
+    file_paths = [
+        os.path.join(folder_path, filename) for filename in sorted(os.listdir(folder_path))
+        if filename.startswith('parsed_data_') and flow_log_parser.is_parsed_output(filename)  # Parsed flow files, not the per-run tables
+    ]
+    results = flow_aggregator.FlowCounter(KEY_FIELDS)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for partial in executor.map(aggregate_file, file_paths):
+            results.merge(partial)
+    return results
+
+# Convert the aggregated counts to rows for the DataFrame
+def result_rows(results):
+    for (source_address, destination_address, destination_port), count, first_seen, last_seen, sample in results.items():
+        sample = dict(zip(SAMPLE_FIELDS, sample or [None] * len(SAMPLE_FIELDS)))
+        security_list_ocids = list(sample.pop('security_list_ocids') or [])
+
+        # Prepare the row data including source, destination, port, and additional fields
+        row_data = {
+            'Source Address': source_address,
+            'Destination Address': destination_address,
+            'Destination Port': destination_port,
+            'Count': count,
+            'First Seen': first_seen,
+            'Last Seen': last_seen,
+            'Traffic Direction': sample.pop('traffic_direction'),
+            'Security List OCID': ', '.join(security_list_ocids),
+            'Security List Names': security_list_names(security_list_ocids)
+        }
+
+        # Flatten the remaining sampled fields for better readability in Excel
+        row_data.update({f"Oracle {key}": value for key, value in sample.items()})
+        yield row_data
+
+def main(max_workers):
+    results = aggregate_folder(folder_path, max_workers)
+
+    # Create a DataFrame from the aggregated rows and write it to an Excel file
+    df = pd.DataFrame(list(result_rows(results)))
+    df.to_excel(output_file, index=False)
+
+    print(f"Aggregated {len(results)} distinct flows")
+    print(f"Results written to {output_file}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count TCP flows in the downloaded parsed flow files")
+    parser.add_argument("--max-workers", type=int, default=QUERY_WORKERS, help="Processes aggregating files in parallel")
+    args = parser.parse_args()
+
+    main(args.max_workers)
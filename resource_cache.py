@@ -0,0 +1,229 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import oci
+
+# On-disk cache of subnets and security lists shared by main.py and get_Flow_Logs_from_OS.py
+CACHE_PATH = r'C:\Security\Blogs\Security_List\Logs\cache\network_resources.db'
+# Entries younger than this are served without calling OCI. It is well past the daily run interval;
+# freshness between runs comes from revalidate()
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+# Entries older than this are revalidated in bulk by revalidate(), one list call per VCN and type
+REVALIDATE_AFTER_SECONDS = 12 * 60 * 60
+# Resources in any other state are still changing, so they are always refetched
+STABLE_LIFECYCLE_STATES = ('AVAILABLE',)
+# Failed lookups are remembered for this long before they are retried
+NEGATIVE_TTL_SECONDS = 5 * 60
+
+
+class ResourceCache:
+    # Subnets and security lists are stored as their API JSON, keyed by OCID, together with the
+    # etag and lifecycle state seen when they were fetched. An entry is served while it is younger
+    # than the TTL and in a stable lifecycle state. The VCN get calls do not honour If-None-Match,
+    # so instead of refetching entries one by one, revalidate() lists the subnets and security
+    # lists of each VCN with cached entries and compares them with the cached payloads. Unchanged
+    # entries only get their timestamp refreshed and keep their etag, which callers can use to
+    # reuse anything they derived from the resource (e.g. compiled rules). An entry that expires
+    # anyway (e.g. its VCN could not be listed) is refetched, and compared by etag.
+    def __init__(self, virtual_network_client, path=CACHE_PATH, ttl=CACHE_TTL_SECONDS):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.client = virtual_network_client
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS resources ("
+                "ocid TEXT PRIMARY KEY, resource_type TEXT, etag TEXT, lifecycle_state TEXT, "
+                "fetched_at REAL, payload TEXT)"
+            )
+
+    def get_subnet(self, subnet_id):
+        return self.get(subnet_id, "Subnet", self.client.get_subnet)
+
+    def get_security_list(self, security_list_id):
+        return self.get(security_list_id, "SecurityList", self.client.get_security_list)
+
+    # Return (model, etag) for the resource, fetching it only when the cached copy is stale
+    def get_with_etag(self, ocid, resource_type, fetch):
+        row = self._load(ocid)
+        now = time.time()
+        if row is not None:
+            etag, lifecycle_state, fetched_at, payload = row
+            if lifecycle_state in STABLE_LIFECYCLE_STATES and now - fetched_at < self.ttl:
+                return self._deserialize(payload, resource_type), etag
+
+        response = fetch(ocid)
+        etag = response.headers.get('etag')
+        if row is not None and etag is not None and etag == row[0]:
+            self._touch(ocid, now, response.data.lifecycle_state)
+        else:
+            self.store(response.data, resource_type, etag, now)
+        return response.data, etag
+
+    def get(self, ocid, resource_type, fetch):
+        return self.get_with_etag(ocid, resource_type, fetch)[0]
+
+    # Record a resource returned by a list call, so a later get is served from the cache. List
+    # responses carry no etag, so the cached etag is kept only if the payload is unchanged.
+    def observe(self, resource, resource_type):
+        payload = self._serialize(resource)
+        now = time.time()
+        row = self._load(resource.id)
+        if row is not None and row[3] == payload:
+            self._touch(resource.id, now, resource.lifecycle_state)
+        else:
+            self.store(resource, resource_type, None, now, payload)
+
+    # Refresh every entry fetched more than older_than seconds ago with one list_subnets and one
+    # list_security_lists call per VCN. Entries the listing no longer returns were deleted and
+    # are dropped. Returns (VCNs listed, entries refreshed).
+    def revalidate(self, older_than=REVALIDATE_AFTER_SECONDS):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT ocid, payload FROM resources WHERE fetched_at < ?", (time.time() - older_than,)
+            ).fetchall()
+        stale_by_vcn = {}
+        for ocid, payload in rows:
+            data = json.loads(payload)
+            if data.get('compartmentId') and data.get('vcnId'):
+                stale_by_vcn.setdefault((data['compartmentId'], data['vcnId']), set()).add(ocid)
+
+        refreshed = 0
+        for (compartment_id, vcn_id), stale in stale_by_vcn.items():
+            try:
+                listed = []
+                for resource_type, list_call in (("Subnet", self.client.list_subnets), ("SecurityList", self.client.list_security_lists)):
+                    resources = oci.pagination.list_call_get_all_results(list_call, compartment_id, vcn_id=vcn_id).data
+                    listed.extend((resource, resource_type) for resource in resources)
+            except oci.exceptions.ServiceError as e:
+                print(f"Failed to revalidate cached resources of VCN {vcn_id}: {e}")
+                continue  # Left to expire and be refetched one by one
+            for resource, resource_type in listed:
+                self.observe(resource, resource_type)
+                refreshed += resource.id in stale
+            for ocid in stale - {resource.id for resource, _ in listed}:
+                self.invalidate(ocid)
+        return len(stale_by_vcn), refreshed
+
+    def store(self, resource, resource_type, etag, fetched_at, payload=None):
+        if payload is None:
+            payload = self._serialize(resource)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?)",
+                (resource.id, resource_type, etag, resource.lifecycle_state, fetched_at, payload)
+            )
+
+    # Drop every entry, so each resource is fetched again (e.g. --refresh-cache)
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM resources")
+
+    def invalidate(self, ocid):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM resources WHERE ocid = ?", (ocid,))
+
+    def _load(self, ocid):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT etag, lifecycle_state, fetched_at, payload FROM resources WHERE ocid = ?", (ocid,)
+            ).fetchone()
+
+    def _touch(self, ocid, fetched_at, lifecycle_state):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE resources SET fetched_at = ?, lifecycle_state = ? WHERE ocid = ?",
+                (fetched_at, lifecycle_state, ocid)
+            )
+
+    def _serialize(self, resource):
+        return json.dumps(self.client.base_client.sanitize_for_serialization(resource))
+
+    def _deserialize(self, payload, resource_type):
+        return self.client.base_client.deserialize_response_data(payload.encode('utf-8'), resource_type)
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlightCache:
+    # In-memory, thread-safe cache for per-run lookups. Concurrent callers asking for the same
+    # missing key wait for a single load instead of each calling the API. A load that returns None
+    # is a failed lookup: it is cached for negative_ttl seconds so the failure is not retried (and
+    # reported) for every record. Exceptions raised by the load are passed to every waiter and not cached.
+    def __init__(self, negative_ttl=NEGATIVE_TTL_SECONDS):
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.values = {}
+        self.in_flight = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key, load):
+        leader = False
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None:
+                    self.hits += 1
+                    return value
+                if time.monotonic() < expires_at:
+                    self.negative_hits += 1
+                    return value
+                del self.values[key]
+            flight = self.in_flight.get(key)
+            if flight is None:
+                flight = _Flight()
+                self.in_flight[key] = flight
+                self.misses += 1
+                leader = True
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = load(key)
+        except BaseException as e:
+            flight.error = e
+            with self.lock:
+                del self.in_flight[key]
+            flight.event.set()
+            raise
+        with self.lock:
+            self.values[key] = (value, None if value is not None else time.monotonic() + self.negative_ttl)
+            del self.in_flight[key]
+        flight.value = value
+        flight.event.set()
+        return value
+
+    # Successfully loaded entries, e.g. to write them out at the end of a run
+    def items(self):
+        with self.lock:
+            return [(key, value) for key, (value, expires_at) in self.values.items() if value is not None]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.values),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced
+            }
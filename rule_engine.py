@@ -0,0 +1,325 @@
+import bisect
+import ipaddress
+import socket
+
+try:
+    import numpy as np
+except ImportError:  # Batch evaluation is optional; the scalar matcher does not need NumPy
+    np = None
+
+# Mapping for protocols (security list rules carry the protocol number, flow logs carry the name)
+PROTOCOL_MAPPING = {
+    "1": "ICMP",
+    "2": "IGMP",
+    "6": "TCP",
+    "17": "UDP",
+    "41": "IPv6",
+    "47": "GRE",
+    "50": "ESP",
+    "51": "AH",
+    "58": "ICMPv6",
+    "88": "EIGRP",
+    "89": "OSPF",
+    "132": "SCTP",
+    "112": "VRRP",
+    "115": "L2TP",
+    "118": "STP",
+    "121": "SMP",
+    "123": "NTP",
+    "137": "NETBIOS",
+    "138": "NETBIOS Datagram Service",
+    "139": "NETBIOS Session Service",
+    "142": "IRTP",
+    "161": "SNMP",
+    "162": "SNMP Trap",
+    "179": "BGP",
+    "199": "SMUX",
+    "204": "ATMP",
+    "224": "NCP",
+    "255": "Reserved"
+}
+
+# Verdict kinds returned by CompiledSecurityList.match
+MATCH_ALL = "ALL"
+MATCH_TCP = "TCP"
+MATCH_UDP = "UDP"
+MATCH_OTHER = "OTHER"
+PROTOCOL_MISMATCH = "MISMATCH"
+
+# Port domain used by the port tables; records without a destination port (e.g. ICMP) use NO_PORT
+NO_PORT = -1
+MAX_PORT = 65535
+
+# Records evaluated per block by match_batch; each block builds (records x rules) boolean matrices
+BATCH_BLOCK_SIZE = 4096
+
+_LOW_64 = (1 << 64) - 1
+
+
+# Parse an address into (version, integer) without building ipaddress objects for IPv4
+def parse_address(address):
+    if not address:
+        return None
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, address), "big")
+    except (OSError, TypeError):
+        pass
+    try:
+        ip_obj = ipaddress.ip_address(address)
+    except ValueError:
+        return None
+    return ip_obj.version, int(ip_obj)
+
+
+# Convert a CIDR into (version, first address, last address) as integers
+def compile_cidr(cidr):
+    network = ipaddress.ip_network(cidr, strict=False)
+    return network.version, int(network.network_address), int(network.broadcast_address)
+
+
+def address_in_range(parsed_address, cidr_range):
+    version, value = parsed_address
+    range_version, low, high = cidr_range
+    return version == range_version and low <= value <= high
+
+
+def parse_port(port):
+    if port is None or port == "":
+        return NO_PORT
+    try:
+        return int(port)
+    except (TypeError, ValueError):
+        return NO_PORT
+
+
+def _destination_port_range(options):
+    if options is None or options.destination_port_range is None:
+        return None
+    return options.destination_port_range.min, options.destination_port_range.max
+
+
+# Fill the parts of [low, high] that no earlier rule has decided yet
+def _fill_gaps(decided, low, high, verdict):
+    gaps = []
+    cursor = low
+    for start, end, _ in decided:
+        if end < cursor:
+            continue
+        if start > high:
+            break
+        if start > cursor:
+            gaps.append((cursor, start - 1, verdict))
+        cursor = max(cursor, end + 1)
+        if cursor > high:
+            break
+    if cursor <= high:
+        gaps.append((cursor, high, verdict))
+    decided.extend(gaps)
+    decided.sort()
+
+
+class CompiledSecurityList:
+    # Build the index once per security list. Rules are evaluated in list order and the first
+    # rule that decides a record wins, exactly like the original per-record rule scan:
+    #   - a rule whose source does not cover the address is skipped
+    #   - protocol "all" matches every port
+    #   - a matching TCP/UDP rule with a destination port range only decides ports inside it
+    #   - any other matching protocol decides every port
+    #   - a rule with a different protocol decides the record as a protocol mismatch
+    def __init__(self, ingress_security_rules):
+        self.rules = list(ingress_security_rules or [])
+        self._rule_protocols = []
+        self._rule_port_ranges = []
+        ranges_by_version = {4: [], 6: []}
+
+        for index, rule in enumerate(self.rules):
+            protocol = str(rule.protocol)
+            if protocol.upper() == 'ALL':
+                self._rule_protocols.append(MATCH_ALL)
+            else:
+                self._rule_protocols.append(PROTOCOL_MAPPING.get(protocol))
+
+            self._rule_port_ranges.append({
+                "TCP": (rule.tcp_options is not None, _destination_port_range(rule.tcp_options)),
+                "UDP": (rule.udp_options is not None, _destination_port_range(rule.udp_options))
+            })
+
+            try:
+                version, low, high = compile_cidr(rule.source)
+            except (TypeError, ValueError):
+                continue  # Sources that are not CIDR blocks (e.g. service CIDR labels) never match
+            ranges_by_version[version].append((low, high, index))
+
+        # Split each address space into elementary segments covered by the same set of rules
+        self._segments = {}
+        for version, ranges in ranges_by_version.items():
+            points = sorted({low for low, _, _ in ranges} | {high + 1 for _, high, _ in ranges})
+            starts = []
+            covering = []
+            fixed = []
+            for point in points:
+                rule_indexes = tuple(index for low, high, index in ranges if low <= point <= high)
+                starts.append(point)
+                covering.append(rule_indexes)
+                # ALL-protocol fast path: the verdict does not depend on protocol or port
+                if rule_indexes and self._rule_protocols[rule_indexes[0]] == MATCH_ALL:
+                    fixed.append((MATCH_ALL, rule_indexes[0]))
+                else:
+                    fixed.append(None)
+            self._segments[version] = (starts, covering, fixed)
+
+        # Port tables are built lazily per (version, segment, protocol) since most lists only see a few
+        self._port_tables = {}
+        self._rule_arrays = None
+
+    def _build_port_table(self, rule_indexes, record_protocol):
+        decided = []
+        for index in rule_indexes:
+            rule_protocol = self._rule_protocols[index]
+            if rule_protocol == MATCH_ALL:
+                _fill_gaps(decided, NO_PORT, MAX_PORT, (MATCH_ALL, index))
+                break
+            if rule_protocol != record_protocol:
+                _fill_gaps(decided, NO_PORT, MAX_PORT, (PROTOCOL_MISMATCH, index))
+                break
+            has_options, port_range = self._rule_port_ranges[index].get(record_protocol, (False, None))
+            if has_options:
+                if port_range is not None:
+                    _fill_gaps(decided, port_range[0], port_range[1], (record_protocol, index))
+                continue
+            _fill_gaps(decided, NO_PORT, MAX_PORT, (MATCH_OTHER, index))
+            break
+
+        lows = [low for low, _, _ in decided]
+        return lows, decided
+
+    # Return (verdict kind, rule index) for the rule that decides the record, or None
+    def match(self, parsed_source, record_protocol, destination_port):
+        version, value = parsed_source
+        segments = self._segments.get(version)
+        if segments is None:
+            return None
+        starts, covering, fixed = segments
+        position = bisect.bisect_right(starts, value) - 1
+        if position < 0 or not covering[position]:
+            return None
+        if fixed[position] is not None:
+            return fixed[position]
+
+        key = (version, position, record_protocol)
+        table = self._port_tables.get(key)
+        if table is None:
+            table = self._build_port_table(covering[position], record_protocol)
+            self._port_tables[key] = table
+        lows, decided = table
+
+        slot = bisect.bisect_right(lows, destination_port) - 1
+        if slot < 0:
+            return None
+        low, high, verdict = decided[slot]
+        if destination_port > high:
+            return None
+        return verdict
+
+    def rule(self, index):
+        return self.rules[index]
+
+    # Rule table as arrays for match_batch: 128-bit networks and masks are split into two uint64 halves
+    def rule_arrays(self):
+        if self._rule_arrays is not None:
+            return self._rule_arrays
+        versions, net_high, net_low, mask_high, mask_low = [], [], [], [], []
+        protocols = []
+        port_ranges = {"TCP": ([], [], []), "UDP": ([], [], [])}
+        for index, rule in enumerate(self.rules):
+            try:
+                network = ipaddress.ip_network(rule.source, strict=False)
+                mask = int(network.netmask)
+                address = int(network.network_address)
+                version = network.version
+            except (TypeError, ValueError):
+                mask, address, version = 0, 0, 0  # Never covers a record
+            versions.append(version)
+            net_high.append(address >> 64)
+            net_low.append(address & _LOW_64)
+            mask_high.append(mask >> 64)
+            mask_low.append(mask & _LOW_64)
+            protocols.append(self._rule_protocols[index])
+            for protocol, (has_options, low, high) in port_ranges.items():
+                rule_has_options, port_range = self._rule_port_ranges[index][protocol]
+                has_options.append(rule_has_options)
+                # A missing range decides no port, so use an empty interval
+                low.append(port_range[0] if port_range is not None else 1)
+                high.append(port_range[1] if port_range is not None else 0)
+
+        self._rule_arrays = {
+            "version": np.array(versions, dtype=np.int8),
+            "net_high": np.array(net_high, dtype=np.uint64),
+            "net_low": np.array(net_low, dtype=np.uint64),
+            "mask_high": np.array(mask_high, dtype=np.uint64),
+            "mask_low": np.array(mask_low, dtype=np.uint64),
+            "protocols": protocols,
+            "is_all": np.array([protocol == MATCH_ALL for protocol in protocols], dtype=bool)
+        }
+        for protocol, (has_options, low, high) in port_ranges.items():
+            self._rule_arrays[protocol] = (np.array(has_options, dtype=bool), np.array(low, dtype=np.int32), np.array(high, dtype=np.int32))
+        return self._rule_arrays
+
+
+# Vectorized equivalent of calling compiled.match for every record. Records are given as parallel
+# lists of parsed sources, upper-case protocol names and destination ports; the verdicts are
+# identical to the scalar path.
+def match_batch(compiled, parsed_sources, record_protocols, destination_ports, block_size=BATCH_BLOCK_SIZE):
+    if np is None:
+        raise RuntimeError("match_batch requires NumPy")
+    verdicts = []
+    if not compiled.rules:
+        return [None] * len(parsed_sources)
+    rules = compiled.rule_arrays()
+
+    # Encode protocol names as integers; rule protocols outside PROTOCOL_MAPPING (None) never equal a record
+    protocol_codes = {}
+    rule_codes = np.array([-1 if protocol == MATCH_ALL else -2 if protocol is None else protocol_codes.setdefault(protocol, len(protocol_codes))
+                           for protocol in rules["protocols"]], dtype=np.int32)
+
+    for start in range(0, len(parsed_sources), block_size):
+        sources = parsed_sources[start:start + block_size]
+        protocols = record_protocols[start:start + block_size]
+        ports = np.array(destination_ports[start:start + block_size], dtype=np.int32)[:, None]
+
+        versions = np.array([version for version, _ in sources], dtype=np.int8)[:, None]
+        high = np.array([value >> 64 for _, value in sources], dtype=np.uint64)[:, None]
+        low = np.array([value & _LOW_64 for _, value in sources], dtype=np.uint64)[:, None]
+        codes = np.array([protocol_codes.get(protocol, -3) for protocol in protocols], dtype=np.int32)[:, None]
+        is_tcp = np.array([protocol == "TCP" for protocol in protocols], dtype=bool)[:, None]
+        is_udp = np.array([protocol == "UDP" for protocol in protocols], dtype=bool)[:, None]
+
+        covers = ((versions == rules["version"]) &
+                  ((high & rules["mask_high"]) == rules["net_high"]) &
+                  ((low & rules["mask_low"]) == rules["net_low"]))
+        is_all = rules["is_all"][None, :]
+        same_protocol = codes == rule_codes
+        tcp_options, tcp_min, tcp_max = rules["TCP"]
+        udp_options, udp_min, udp_max = rules["UDP"]
+        tcp_ranged = is_tcp & tcp_options
+        udp_ranged = is_udp & udp_options
+        ranged = tcp_ranged | udp_ranged
+        in_range = ((tcp_ranged & (tcp_min <= ports) & (ports <= tcp_max)) |
+                    (udp_ranged & (udp_min <= ports) & (ports <= udp_max)))
+
+        decisive = covers & (is_all | ~same_protocol | ~ranged | in_range)
+        first = decisive.argmax(axis=1)
+        found = decisive[np.arange(len(sources)), first]
+
+        for row, rule_index in enumerate(first.tolist()):
+            if not found[row]:
+                verdicts.append(None)
+            elif is_all[0, rule_index]:
+                verdicts.append((MATCH_ALL, rule_index))
+            elif not same_protocol[row, rule_index]:
+                verdicts.append((PROTOCOL_MISMATCH, rule_index))
+            elif ranged[row, rule_index]:
+                verdicts.append((MATCH_TCP if is_tcp[row, 0] else MATCH_UDP, rule_index))
+            else:
+                verdicts.append((MATCH_OTHER, rule_index))
+    return verdicts
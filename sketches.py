@@ -0,0 +1,168 @@
+import hashlib
+import heapq
+import math
+from array import array
+
+# Mergeable, fixed-size summaries for high-cardinality flow counts. Hashes are derived from
+# blake2b rather than hash() so sketches built in different processes can be merged.
+
+# Default error bounds: counts are overestimated by at most EPSILON * total with probability 1 - DELTA
+EPSILON = 0.001
+DELTA = 0.01
+TOP_K = 100
+# HeavyHitters tracks this many candidates per reported key, so a key that is spread thinly over
+# many partial results still survives the merges
+CANDIDATE_FACTOR = 4
+# Relative standard error of HyperLogLog distinct counts
+HLL_ERROR = 0.03
+
+_MASK_64 = (1 << 64) - 1
+
+
+def _key_bytes(key):
+    if isinstance(key, tuple):
+        return "\x1f".join(str(part) for part in key).encode('utf-8')
+    return str(key).encode('utf-8')
+
+
+# Two independent 64-bit hashes of a key
+def hash_pair(key):
+    digest = hashlib.blake2b(_key_bytes(key), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+
+class CountMinSketch:
+    # depth rows of width counters; an estimate never undercounts and overcounts by at most
+    # epsilon * total with probability 1 - delta
+    def __init__(self, epsilon=EPSILON, delta=DELTA):
+        self.epsilon = epsilon
+        self.delta = delta
+        self.width = int(math.ceil(math.e / epsilon))
+        self.depth = int(math.ceil(math.log(1 / delta)))
+        self.table = [array('q', bytes(8 * self.width)) for _ in range(self.depth)]
+        self.total = 0
+
+    def _columns(self, hashes):
+        h1, h2 = hashes
+        return [(h1 + row * h2) % self.width for row in range(self.depth)]
+
+    # Add count occurrences of key and return its new estimate
+    def add(self, key, count=1, hashes=None):
+        columns = self._columns(hashes or hash_pair(key))
+        self.total += count
+        estimate = None
+        for row, column in zip(self.table, columns):
+            row[column] += count
+            estimate = row[column] if estimate is None else min(estimate, row[column])
+        return estimate
+
+    def estimate(self, key, hashes=None):
+        columns = self._columns(hashes or hash_pair(key))
+        return min(row[column] for row, column in zip(self.table, columns))
+
+    # Largest overcount expected for any key at the configured confidence
+    def error_bound(self):
+        return int(math.ceil(self.epsilon * self.total))
+
+    def merge(self, other):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Count-Min sketches must have the same dimensions to be merged")
+        for row, other_row in zip(self.table, other.table):
+            for column, value in enumerate(other_row):
+                if value:
+                    row[column] += value
+        self.total += other.total
+        return self
+
+
+class HeavyHitters:
+    # Top-k keys by Count-Min estimate. Only k * CANDIDATE_FACTOR candidate keys are stored; a new
+    # key displaces the smallest candidate when its estimate is larger. Candidates are also kept in
+    # a min-heap of (estimate, sequence, key) entries; an entry whose estimate no longer matches
+    # its candidate is stale and skipped, so finding and evicting the smallest costs O(log k).
+    # Merging adds the sketches and re-ranks the union of both candidate sets against the merged sketch.
+    def __init__(self, k=TOP_K, epsilon=EPSILON, delta=DELTA):
+        self.k = k
+        self.capacity = k * CANDIDATE_FACTOR
+        self.sketch = CountMinSketch(epsilon, delta)
+        self.candidates = {}
+        self.heap = []
+        self.sequence = 0
+        self.floor = 0  # Smallest candidate estimate once the candidates are full, 0 until then
+
+    def _push(self, key, estimate):
+        self.candidates[key] = estimate
+        self.sequence += 1
+        heapq.heappush(self.heap, (estimate, self.sequence, key))
+        if len(self.heap) > 4 * self.capacity:
+            self._rebuild_heap()  # Drop the stale entries left by updated candidates
+
+    def _rebuild_heap(self):
+        self.heap = []
+        for key, estimate in self.candidates.items():
+            self.sequence += 1
+            self.heap.append((estimate, self.sequence, key))
+        heapq.heapify(self.heap)
+
+    # Discard stale entries until the top of the heap is a current candidate
+    def _smallest(self):
+        while True:
+            estimate, _, key = self.heap[0]
+            if self.candidates.get(key) == estimate:
+                return estimate, key
+            heapq.heappop(self.heap)
+
+    def add(self, key, count=1):
+        estimate = self.sketch.add(key, count)
+        if key in self.candidates or len(self.candidates) < self.capacity:
+            self._push(key, estimate)
+            if len(self.candidates) >= self.capacity:
+                self.floor = self._smallest()[0]
+        elif estimate > self.floor:
+            del self.candidates[self._smallest()[1]]
+            heapq.heappop(self.heap)
+            self._push(key, estimate)
+            self.floor = self._smallest()[0]
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        keys = set(self.candidates) | set(other.candidates)
+        ranked = sorted(((self.sketch.estimate(key), key) for key in keys), key=lambda item: item[0], reverse=True)
+        self.candidates = {key: estimate for estimate, key in ranked[:self.capacity]}
+        self._rebuild_heap()
+        self.floor = self._smallest()[0] if len(self.candidates) >= self.capacity else 0
+        return self
+
+    # The top k (key, estimated count) pairs, largest first
+    def items(self):
+        return sorted(self.candidates.items(), key=lambda item: item[1], reverse=True)[:self.k]
+
+
+class HyperLogLog:
+    # Distinct count estimate in 2^precision one-byte registers
+    def __init__(self, error=HLL_ERROR):
+        self.precision = min(16, max(4, int(math.ceil(math.log2((1.04 / error) ** 2)))))
+        self.registers = bytearray(1 << self.precision)
+
+    def add(self, key, hashes=None):
+        value = (hashes or hash_pair(key))[0]
+        index = value >> (64 - self.precision)
+        remaining = (value << self.precision) & _MASK_64
+        rank = 64 - self.precision + 1 if remaining == 0 else 65 - remaining.bit_length()
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.673 if m == 16 else 0.697 if m == 32 else 0.709 if m == 64 else 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # Linear counting for small cardinalities
+        return int(round(estimate))
+
+    def merge(self, other):
+        if len(self.registers) != len(other.registers):
+            raise ValueError("HyperLogLogs must have the same precision to be merged")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self